@@ -2,7 +2,7 @@ import argparse
 import logging
 from typing import Optional
 
-from .logger import LanguageServerLogHandler
+from .logger import BufferedFileHandler, LanguageServerLogHandler
 from .server import ConnectionMethod, Server
 
 _logger = logging.getLogger(__name__)
@@ -17,7 +17,7 @@ def setup_logger(log_file: Optional[str]) -> LanguageServerLogHandler:
     package_logger.addHandler(ls_handler)
 
     if log_file:
-        file_handler = logging.FileHandler(log_file, mode="w")
+        file_handler = BufferedFileHandler(log_file)
         file_handler.setLevel(logging.INFO)
         package_logger.addHandler(file_handler)
 
@@ -1,7 +1,17 @@
-from typing import List
+import copy
+import functools
+import json
+from typing import Any, Dict, List, cast
 
 from pygls.lsp.types import Model
 
+_DEFAULT_CONFIGURATION: Dict[str, Any] = {
+    "enable_lint_on_save": True,
+    "enable_code_action": True,
+    "lint_targets": ["lint"],
+    "format_targets": ["format", "lint"],
+}
+
 
 class LanguageServerConfiguration(Model):  # type: ignore
     enable_lint_on_save: bool
@@ -11,9 +21,32 @@ class LanguageServerConfiguration(Model):  # type: ignore
 
     @classmethod
     def default(cls) -> "LanguageServerConfiguration":
-        return cls(
-            enable_lint_on_save=True,
-            enable_code_action=True,
-            lint_targets=["lint"],
-            format_targets=["format", "lint"],
+        # NOTE: The default values are known to be valid, so we skip validation.
+        # The values are copied so that callers can modify the returned instance.
+        return cast(
+            LanguageServerConfiguration,
+            cls.construct(**copy.deepcopy(_DEFAULT_CONFIGURATION)),
+        )
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_config(data: str) -> LanguageServerConfiguration:
+    # NOTE: lru_cache doesn't cache exceptions, so invalid configs are re-validated
+    return cast(
+        LanguageServerConfiguration, LanguageServerConfiguration.parse_raw(data)
+    )
+
+
+def parse_config(obj: Any) -> LanguageServerConfiguration:
+    """Parse the configuration, reusing the result for the same settings
+
+    The returned instance is shared and must not be modified.
+    """
+    try:
+        data = json.dumps(obj, sort_keys=True)
+    except (TypeError, ValueError):
+        return cast(
+            LanguageServerConfiguration, LanguageServerConfiguration.parse_obj(obj)
         )
+
+    return _parse_config(data)
@@ -1,11 +1,22 @@
-from typing import List, Optional, Sequence, cast
+import functools
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 
-import pysen.diagnostic
 from pygls.lsp.types import (
     CodeAction,
     CodeActionKind,
     Diagnostic,
     DiagnosticSeverity,
+    Model,
     OptionalVersionedTextDocumentIdentifier,
     Position,
     Range,
@@ -16,59 +27,116 @@ from pygls.lsp.types import (
 
 from .types import DocumentVersionType
 
+if TYPE_CHECKING:
+    import pysen.diagnostic
+
+# NOTE: Models in this module are built only from values we computed ourselves,
+# so pydantic validation is skipped unless this flag is enabled (e.g. in tests).
+_VALIDATE_MODELS = False
+
+_ModelT = TypeVar("_ModelT", bound=Model)
+
+
+def _create_model(model: Type[_ModelT], **values: Any) -> _ModelT:
+    if _VALIDATE_MODELS:
+        # NOTE: The validated model is discarded since pydantic copies nested models,
+        # while the runtime relies on the identity of the diagnostics it references.
+        model(**values)
+
+    return cast(_ModelT, model.construct(**values))
+
+
+def copy_model(model: _ModelT, **values: Any) -> _ModelT:
+    """Return a shallow copy of the model with the given fields replaced"""
+    if _VALIDATE_MODELS:
+        model.__class__(**{**model.__dict__, **values})
+
+    # NOTE: Same as `construct` without looking up the defaults of each field,
+    # which dominates the cost of shifting ranges of many code actions.
+    # The replaced fields are already set, so `__fields_set__` is shared.
+    copied = model.__class__.__new__(model.__class__)
+    object.__setattr__(copied, "__dict__", {**model.__dict__, **values})
+    object.__setattr__(copied, "__fields_set__", model.__fields_set__)
+    return cast(_ModelT, copied)
+
 
 def _has_deletion(diff: str) -> bool:
-    return any(line for line in diff.splitlines() if line.startswith("-"))
+    return diff.startswith("-") or "\n-" in diff
 
 
-def get_diagnostic_range(diagnostic: pysen.diagnostic.Diagnostic) -> Range:
+# NOTE: Only the diff analysis is memoized. Models built from it are never shared
+# since the runtime replaces (not modifies) those it publishes.
+@functools.lru_cache(maxsize=4096)
+def _analyze_diff(diff: str) -> Tuple[bool, str]:
+    """Return whether the diff has deletions and the text after applying it"""
+    has_deletion = False
+    new_text: List[str] = []
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("-"):
+            has_deletion = True
+        elif line.startswith("+") or line.startswith(" "):
+            new_text.append(line[1:])
+
+    return has_deletion, "".join(new_text)
+
+
+def get_diagnostic_range(
+    diagnostic: "pysen.diagnostic.Diagnostic",
+    has_deletion: Optional[bool] = None,
+) -> Range:
     start_line = diagnostic.start_line or 1
     start_column = diagnostic.start_column or 1
     end_line = diagnostic.end_line or start_line
-    if diagnostic.diff is not None:
-        if _has_deletion(diagnostic.diff):
-            end_line += 1
+    # NOTE: `has_deletion` is given when the caller has already scanned the diff
+    if has_deletion is None and diagnostic.diff is not None:
+        has_deletion = _has_deletion(diagnostic.diff)
+    if has_deletion:
+        end_line += 1
 
     end_column = start_column
     if start_line != end_line:
         end_column = 1
 
-    return Range(
-        start=Position(line=start_line - 1, character=start_column - 1),
-        end=Position(line=end_line - 1, character=end_column - 1),
+    return _create_model(
+        Range,
+        start=_create_model(Position, line=start_line - 1, character=start_column - 1),
+        end=_create_model(Position, line=end_line - 1, character=end_column - 1),
     )
 
 
+def get_position_key(position: Position) -> int:
+    """Pack the position into an int which preserves the order of positions"""
+    return cast(int, (position.line << 32) | position.character)
+
+
 def has_overlap(lhs: Range, rhs: Range) -> bool:
     """Check if lhs has overlap with rhs"""
     return cast(bool, max(lhs.start, rhs.start) <= min(lhs.end, rhs.end))
 
 
-def create_text_edit(diagnostic: pysen.diagnostic.Diagnostic) -> TextEdit:
+def create_text_edit(diagnostic: "pysen.diagnostic.Diagnostic") -> TextEdit:
     assert diagnostic.diff is not None, "diff must not be None"
 
     # TODO(igarashi): Use unidiff to get hunks
-    edit_range = get_diagnostic_range(diagnostic)
-    new_text: List[str] = []
-    for line in diagnostic.diff.splitlines(keepends=True):
-        if line.startswith("+") or line.startswith(" "):
-            new_text.append(line[1:])
-
-    return TextEdit(
+    has_deletion, new_text = _analyze_diff(diagnostic.diff)
+    edit_range = get_diagnostic_range(diagnostic, has_deletion)
+    return _create_model(
+        TextEdit,
         range=edit_range,
-        new_text="".join(new_text),
+        new_text=new_text,
     )
 
 
 def create_diagnostic(
-    diagnostic: pysen.diagnostic.Diagnostic,
+    diagnostic: "pysen.diagnostic.Diagnostic",
     default_message: str,
     code: Optional[str],
     source: str,
 ) -> Diagnostic:
     message = diagnostic.message or default_message
 
-    return Diagnostic(
+    return _create_model(
+        Diagnostic,
         range=get_diagnostic_range(diagnostic),
         message=message,
         severity=DiagnosticSeverity.Error,
@@ -83,21 +151,25 @@ def create_code_action(
     title: str,
     document_uri: str,
     document_version: Optional[DocumentVersionType],
-    diagnostic: pysen.diagnostic.Diagnostic,
+    diagnostic: "pysen.diagnostic.Diagnostic",
     reference_diagnostics: Sequence[Diagnostic],
 ) -> Optional[CodeAction]:
     if diagnostic.diff is None:
         return None
 
     edit = create_text_edit(diagnostic)
-    return CodeAction(
+    return _create_model(
+        CodeAction,
         title=title,
         kind=CodeActionKind.QuickFix,
         diagnostics=list(reference_diagnostics),
-        edit=WorkspaceEdit(
+        edit=_create_model(
+            WorkspaceEdit,
             document_changes=[
-                TextDocumentEdit(
-                    text_document=OptionalVersionedTextDocumentIdentifier(
+                _create_model(
+                    TextDocumentEdit,
+                    text_document=_create_model(
+                        OptionalVersionedTextDocumentIdentifier,
                         uri=document_uri,
                         version=document_version,
                     ),
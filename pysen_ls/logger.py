@@ -1,5 +1,9 @@
+import collections
+import itertools
 import logging
-from typing import Optional
+import threading
+from operator import itemgetter
+from typing import Callable, Deque, Optional, Tuple
 
 from pygls.lsp.types import MessageType
 from pygls.server import LanguageServer
@@ -12,28 +16,127 @@ _LogLevelMap = {
     logging.CRITICAL: MessageType.Error,
 }
 
+_DEFAULT_FLUSH_INTERVAL = 0.05
+_DEFAULT_FILE_FLUSH_INTERVAL = 0.2
+_FILE_BUFFER_SIZE = 65536
+
 
 def _convert_loglevel(loglevel: int) -> MessageType:
     return _LogLevelMap.get(loglevel, MessageType.Info)
 
 
 class LanguageServerLogHandler(logging.Handler):
-    def __init__(self) -> None:
+    def __init__(self, flush_interval: float = _DEFAULT_FLUSH_INTERVAL) -> None:
         super().__init__(logging.DEBUG)
 
         self._server: Optional[LanguageServer] = None
+        self._send: Optional[Callable[[str, MessageType], None]] = None
+        self._flush_interval = flush_interval
+        self._buffer: Deque[Tuple[MessageType, str]] = collections.deque()
+        self._timer: Optional[threading.Timer] = None
 
     @property
     def server(self) -> Optional[LanguageServer]:
         return self._server
 
     @server.setter
-    def server(self, server: LanguageServer) -> None:
+    def server(self, server: Optional[LanguageServer]) -> None:
+        # NOTE: Send pending messages to the server they were emitted for
+        self.flush()
         self._server = server
+        self._send = server.show_message_log if server is not None else None
 
     def emit(self, record: logging.LogRecord) -> None:
-        server = self.server
-        if server is None:
+        # NOTE: `handle` calls this method while holding `self.lock`
+        if self._send is None:
+            return
+
+        self._buffer.append((_convert_loglevel(record.levelno), str(record.msg)))
+        if self._timer is None:
+            self._timer = threading.Timer(self._flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            records = list(self._buffer)
+            self._buffer.clear()
+            send = self._send
+        finally:
+            self.release()
+
+        if send is None:
             return
 
-        server.show_message_log(str(record.msg), _convert_loglevel(record.levelno))
+        # NOTE: Consecutive messages with the same type are sent as one notification
+        for message_type, group in itertools.groupby(records, key=itemgetter(0)):
+            send("\n".join(m for _, m in group), message_type)
+
+    def close(self) -> None:
+        # NOTE: `logging.shutdown` calls this method at exit
+        self.flush()
+        super().close()
+
+
+class BufferedFileHandler(logging.StreamHandler):
+    """Write records to a file without flushing the stream on every record
+
+    Records at `flush_level` or above are flushed immediately
+    so that they are not lost even if the process crashes.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        flush_interval: float = _DEFAULT_FILE_FLUSH_INTERVAL,
+        flush_level: int = logging.ERROR,
+    ) -> None:
+        super().__init__(
+            open(filename, "w", buffering=_FILE_BUFFER_SIZE, encoding="utf-8")
+        )
+
+        self._flush_interval = flush_interval
+        self._flush_level = flush_level
+        self._timer: Optional[threading.Timer] = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # NOTE: `handle` calls this method while holding `self.lock`
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if record.levelno >= self._flush_level:
+            # NOTE: `self.lock` is reentrant
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(self._flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.stream.closed:
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            try:
+                self.flush()
+                self.stream.close()
+            finally:
+                super().close()
+        finally:
+            self.release()
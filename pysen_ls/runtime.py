@@ -1,45 +1,122 @@
 import abc
-import dataclasses
+import argparse
+import bisect
+import collections
+import functools
 import logging
 import os
 import pathlib
+import posixpath
+import stat
+import sys
 import threading
-from itertools import chain
-from typing import Dict, Iterable, List, Optional, Tuple
+from itertools import accumulate, islice
+from operator import attrgetter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from pygls.lsp.types import (
+    CodeAction,
+    Diagnostic,
+    Range,
+    TextDocumentEdit,
+    TextEdit,
+)
+
+from .diagnostic import (
+    copy_model,
+    create_code_action,
+    create_diagnostic,
+    get_position_key,
+)
+from .types import DocumentVersionType
 
-import pysen
-import tomlkit
-from pygls.lsp.types import CodeAction, Diagnostic, Range, TextDocumentEdit
-from pysen import load_manifest
-from pysen.pyproject_model import has_tool_section
+# NOTE: pysen is imported lazily since it takes a while to import.
+# The first import happens in `warmup`, i.e., after the server is initialized.
+if TYPE_CHECKING:
+    import pysen
+    from pysen.manifest import ManifestBase
 
-from .diagnostic import create_code_action, create_diagnostic, has_overlap
-from .types import DocumentVersionType
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
 
 _logger = logging.getLogger(__name__)
 
+_T = TypeVar("_T")
+
+# NOTE: Number of edits kept to be replayed onto results of runs in progress
+_MAX_EDIT_HISTORY = 1024
+
+# NOTE: pysen runs each tool after changing the working directory of the process
+# (`pysen.path.change_dir`), so runs must not overlap even for different projects
+_RUNNER_LOCK = threading.Lock()
+
 
+@functools.lru_cache(maxsize=4096)
 def _get_uri(base_uri: str, base_path: pathlib.Path, path: pathlib.Path) -> str:
     relpath = ""
     if not path.is_absolute():
-        relpath = str(path)
+        relpath = path.as_posix()
     else:
-        relpath = os.path.relpath(path, base_path)
+        try:
+            # NOTE: Avoid os.path.relpath, which calls os.getcwd() for each call
+            relpath = path.relative_to(base_path).as_posix()
+        except ValueError:
+            relpath = pathlib.Path(os.path.relpath(path, base_path)).as_posix()
+
+    # NOTE: URIs always use "/" as the separator
+    return posixpath.join(base_uri, relpath)
+
+
+@functools.lru_cache(maxsize=512)
+def _has_pysen_section(path: pathlib.Path, mtime_ns: int) -> bool:
+    from pysen.pyproject_model import has_tool_section
+
+    # NOTE: `mtime_ns` is only used as a part of the cache key.
+    # tomllib is much faster than tomlkit since it doesn't preserve the style
+    # of the document. `has_tool_section` works with a plain dict.
+    with path.open("rb") as f:
+        pyproject: Any = tomllib.load(f)
+    return has_tool_section("jiro", pyproject) or has_tool_section("pysen", pyproject)
+
+
+def _pyproject_for_dir(directory: pathlib.Path) -> Optional[pathlib.Path]:
+    # NOTE: Only the parsed result is cached, so pyproject.toml which is created
+    # or modified later is found without resetting the cache
+    path = directory / "pyproject.toml"
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+
+    if stat.S_ISREG(st.st_mode) and _has_pysen_section(path, st.st_mtime_ns):
+        return path
 
-    return os.path.join(base_uri, relpath)
+    return None
 
 
 def _find_pyproject(find_base: pathlib.Path) -> pathlib.Path:
     current = find_base
 
     while True:
-        path = current / "pyproject.toml"
-        if path.exists() and path.is_file():
-            pyproject = tomlkit.loads(path.read_text())
-            if has_tool_section("jiro", pyproject) or has_tool_section(
-                "pysen", pyproject
-            ):
-                return path
+        path = _pyproject_for_dir(current)
+        if path is not None:
+            return path
 
         # reached root
         if current.parent == current:
@@ -48,18 +125,283 @@ def _find_pyproject(find_base: pathlib.Path) -> pathlib.Path:
         current = current.parent
 
 
+@functools.lru_cache(maxsize=32)
+def _load_project(
+    project_path: pathlib.Path, mtime_ns: int
+) -> Tuple["ManifestBase", "pysen.Runner", argparse.Namespace]:
+    import pysen
+
+    # NOTE: `mtime_ns` is only used as a part of the cache key so that
+    # any modification to pyproject.toml invalidates the cached manifest.
+    manifest = pysen.load_manifest(project_path)
+    runner = pysen.Runner(manifest)
+    args = runner.parse_manifest_arguments([])
+    return manifest, runner, args
+
+
+def is_cancelled(cancel: Optional[threading.Event]) -> bool:
+    return cancel is not None and cancel.is_set()
+
+
+def warmup(find_base: pathlib.Path) -> None:
+    """Load the pysen project for the given path into the cache in advance"""
+    from pysen.exceptions import PysenError
+
+    try:
+        project_path = _find_pyproject(find_base.resolve())
+        _load_project(project_path, project_path.stat().st_mtime_ns)
+    except (FileNotFoundError, PysenError):
+        # NOTE: Errors are reported when a runtime is actually created
+        _logger.info(f"skipped warmup for '{find_base}'")
+
+
 def reset_cache() -> None:
     import pysen.git_utils
 
     pysen.git_utils.list_indexed_files.cache_clear()
+    _has_pysen_section.cache_clear()
+    _load_project.cache_clear()
+
+
+def _flatten(lists: Iterable[List[_T]]) -> List[_T]:
+    # NOTE: list.extend is faster than itertools.chain for a few lists
+    ret: List[_T] = []
+    for values in lists:
+        ret.extend(values)
+    return ret
 
 
-@dataclasses.dataclass
-class DiagnosticWithUri:
+def _iter_code_action_ranges(code_action: CodeAction) -> Iterator[Range]:
+    if code_action.edit is not None:
+        for change in code_action.edit.document_changes:
+            if not isinstance(change, TextDocumentEdit):
+                continue
+
+            for edit in change.edits:
+                yield edit.range
+
+    if code_action.diagnostics is not None:
+        for diagnostic in code_action.diagnostics:
+            yield diagnostic.range
+
+
+class _CodeActionIndex:
+    """Index code actions by the line ranges of their diagnostics"""
+
+    def __init__(self, code_actions: List[CodeAction]) -> None:
+        self._code_actions = code_actions
+
+        entries: List[Tuple[int, int, int]] = []
+        for idx, code_action in enumerate(self._code_actions):
+            if code_action.diagnostics is None:
+                continue
+
+            for diagnostic in code_action.diagnostics:
+                r = diagnostic.range
+                entries.append(
+                    (get_position_key(r.start), get_position_key(r.end), idx)
+                )
+        entries.sort(key=lambda e: e[0])
+
+        # NOTE: Entries are stored as parallel lists of packed positions
+        # so that queries compare ints instead of pydantic models.
+        self._start_keys = [e[0] for e in entries]
+        self._end_keys = [e[1] for e in entries]
+        self._indices = [e[2] for e in entries]
+        self._start_lines = [k >> 32 for k in self._start_keys]
+        # NOTE: `_max_end_lines[i]` is the maximum end line of `entries[:i + 1]`,
+        # which is non-decreasing and thus can be bisected.
+        self._max_end_lines = list(accumulate((k >> 32 for k in self._end_keys), max))
+
+    def query(self, target_range: Range) -> List[CodeAction]:
+        # entries before `lo` end before the target starts,
+        # and entries after `hi` start after the target ends.
+        lo = bisect.bisect_left(self._max_end_lines, target_range.start.line)
+        hi = bisect.bisect_right(self._start_lines, target_range.end.line)
+
+        target_start = get_position_key(target_range.start)
+        target_end = get_position_key(target_range.end)
+        start_keys = self._start_keys
+        end_keys = self._end_keys
+        indices = self._indices
+
+        # NOTE: Same condition as `has_overlap`
+        matched: Set[int] = set()
+        for i in range(lo, hi):
+            if max(start_keys[i], target_start) <= min(end_keys[i], target_end):
+                matched.add(indices[i])
+
+        return [self._code_actions[idx] for idx in sorted(matched)]
+
+
+class DiagnosticWithUri(NamedTuple):
     uri: str
     diagnostic: Diagnostic
 
 
+# NOTE: (start line, start character, end line, end character,
+# number of added lines, number of characters added to the last line)
+_TextEditShift = Tuple[int, int, int, int, int, int]
+
+
+def _get_text_edit_shift(updated_range: Range, update_text: str) -> _TextEditShift:
+    # NOTE: splitlines() ignores the last line if empty while split() doesn't
+    # e.g. '' -> [], 'a\n' -> ['a']
+    # Here we need the split() behavior while splitlines() can split lines with
+    # unversal newlines.
+    # Hence we add character 'a' to the given text, then remove it after we call
+    # splitlines() so that we can get the last empty line
+    to_add = (update_text + "a").splitlines()
+    to_add[-1] = to_add[-1][:-1]
+    num_remove_lines = updated_range.end.line - updated_range.start.line
+    num_add_lines = len(to_add) - 1
+    num_updated_lines = num_add_lines - num_remove_lines
+    num_add_characters_last_line = len(to_add[-1])
+
+    # NOTE: Compare plain ints rather than `Position` objects when shifting
+    return (
+        updated_range.start.line,
+        updated_range.start.character,
+        updated_range.end.line,
+        updated_range.end.character,
+        num_updated_lines,
+        num_add_characters_last_line,
+    )
+
+
+def _shift_results(
+    diagnostics: Dict[str, List[DiagnosticWithUri]],
+    code_actions: Dict[str, List[CodeAction]],
+    text_edits: Sequence[Tuple[Range, str]],
+) -> Tuple[Dict[str, List[DiagnosticWithUri]], Dict[str, List[CodeAction]]]:
+    """Shift results by text edits (applied in order) without modifying them"""
+    shifts = [_get_text_edit_shift(r, t) for r, t in text_edits]
+
+    # NOTE: Code actions are not modified since readers may still hold them.
+    # Only the models containing shifted ranges are copied (shallowly),
+    # and the diagnostics shared with `diagnostics` are remapped to the copies.
+    shifted: Dict[int, Diagnostic] = {}
+    # NOTE: Edits and diagnostics of a code action usually have the same range
+    shifted_ranges: Dict[Tuple[int, int, int, int], Range] = {}
+
+    def shift_range(target_range: Range) -> Optional[Range]:
+        """Return the shifted range, or None if it overlaps with the edit"""
+        start = target_range.start
+        end = target_range.end
+        key: Tuple[int, int, int, int] = (
+            start.line,
+            start.character,
+            end.line,
+            end.character,
+        )
+        start_line, start_character, end_line, end_character = key
+        for (
+            updated_start_line,
+            updated_start_character,
+            updated_end_line,
+            updated_end_character,
+            num_updated_lines,
+            num_add_characters_last_line,
+        ) in shifts:
+            if end_line < updated_start_line or (
+                end_line == updated_start_line
+                and end_character < updated_start_character
+            ):
+                continue
+
+            if start_line < updated_end_line:
+                return None
+
+            # update position
+            start_line += num_updated_lines
+            end_line += num_updated_lines
+            if start_line == updated_end_line:
+                if start_character <= updated_end_character:
+                    return None
+
+                start_character += num_add_characters_last_line
+
+        if (start_line, start_character, end_line) == key[:3]:
+            return target_range
+
+        if key not in shifted_ranges:
+            shifted_ranges[key] = copy_model(
+                target_range,
+                start=copy_model(start, line=start_line, character=start_character),
+                end=copy_model(end, line=end_line),
+            )
+        return shifted_ranges[key]
+
+    def shift_code_action(code_action: CodeAction) -> Optional[CodeAction]:
+        """Return the shifted code action, or None if it overlaps with the edit"""
+        ranges: List[Range] = []
+        changed = False
+        for target_range in _iter_code_action_ranges(code_action):
+            shifted_range = shift_range(target_range)
+            if shifted_range is None:
+                return None
+            changed = changed or shifted_range is not target_range
+            ranges.append(shifted_range)
+
+        if not changed:
+            return code_action
+
+        # NOTE: Rebuild the models containing the ranges in the same order as
+        # `_iter_code_action_ranges`, sharing all the others
+        shifted_iter = iter(ranges)
+        edit = code_action.edit
+        document_changes: List[Any] = []
+        for change in edit.document_changes:
+            if isinstance(change, TextDocumentEdit):
+                edits: List[TextEdit] = [
+                    copy_model(e, range=next(shifted_iter)) for e in change.edits
+                ]
+                change = copy_model(change, edits=edits)
+            document_changes.append(change)
+
+        reference_diagnostics: Optional[List[Diagnostic]] = None
+        if code_action.diagnostics is not None:
+            reference_diagnostics = []
+            for diagnostic in code_action.diagnostics:
+                diagnostic_range = next(shifted_iter)
+                if diagnostic_range is not diagnostic.range:
+                    copied = copy_model(diagnostic, range=diagnostic_range)
+                    shifted[id(diagnostic)] = copied
+                    diagnostic = copied
+                reference_diagnostics.append(diagnostic)
+
+        return copy_model(
+            code_action,
+            edit=copy_model(edit, document_changes=document_changes),
+            diagnostics=reference_diagnostics,
+        )
+
+    updated_code_actions: Dict[str, List[CodeAction]] = {}
+    for command, actions in code_actions.items():
+        kept: List[CodeAction] = []
+        for code_action in actions:
+            if code_action.edit is None:
+                continue
+
+            shifted_code_action = shift_code_action(code_action)
+            if shifted_code_action is not None:
+                kept.append(shifted_code_action)
+
+        updated_code_actions[command] = kept
+
+    if not shifted:
+        return diagnostics, updated_code_actions
+
+    updated_diagnostics = {
+        command: [
+            DiagnosticWithUri(d.uri, shifted.get(id(d.diagnostic), d.diagnostic))
+            for d in values
+        ]
+        for command, values in diagnostics.items()
+    }
+    return updated_diagnostics, updated_code_actions
+
+
 class Runtime(abc.ABC):
     def __init__(
         self, base_uri: str, target_path: pathlib.Path, find_base: pathlib.Path
@@ -72,12 +414,20 @@ class Runtime(abc.ABC):
         self._project_path = _find_pyproject(find_base)
         # get mtime to detect whether the project is out-dated
         self._base_dir = self._project_path.parent
-        self._manifest = load_manifest(self._project_path)
-        self._runner = pysen.Runner(self._manifest)
-        self._args = self._runner.parse_manifest_arguments([])
+        self._manifest, self._runner, self._args = _load_project(
+            self._project_path, self._project_path.stat().st_mtime_ns
+        )
 
+        # NOTE: These dicts and the results in them are never modified once
+        # published. Writers build new dicts (copying the results to be changed)
+        # under `self._lock` and swap the reference, so readers can iterate over
+        # them without the lock and observe either the old or the new results.
         self._diagnostics: Dict[str, List[DiagnosticWithUri]] = {}
         self._code_actions: Dict[str, List[CodeAction]] = {}
+        # NOTE: Built lazily, and only valid for the `_code_actions` it came from
+        self._code_action_index: Optional[
+            Tuple[Dict[str, List[CodeAction]], _CodeActionIndex]
+        ] = None
 
     @property
     def base_uri(self) -> str:
@@ -93,27 +443,30 @@ class Runtime(abc.ABC):
 
     def _run_pysen(
         self, command: str, target_files: Optional[List[pathlib.Path]]
-    ) -> pysen.ReporterFactory:
+    ) -> "pysen.ReporterFactory":
+        import pysen
+
         reporter_factory = pysen.ReporterFactory(
             pretty=False, process_output=False, loglevel=logging.CRITICAL
         )
         options = pysen.RunOptions(require_diagnostics=True)
 
-        self._runner.run(
-            command,
-            self._base_dir,
-            self._args,
-            reporter_factory,
-            options,
-            files=target_files,
-        )
+        with _RUNNER_LOCK:
+            self._runner.run(
+                command,
+                self._base_dir,
+                self._args,
+                reporter_factory,
+                options,
+                files=target_files,
+            )
 
         return reporter_factory
 
     def _convert_reports(
         self,
         command: str,
-        reporter_factory: pysen.ReporterFactory,
+        reporter_factory: "pysen.ReporterFactory",
     ) -> Tuple[List[DiagnosticWithUri], List[CodeAction]]:
         diagnostics: List[DiagnosticWithUri] = []
         code_actions: List[CodeAction] = []
@@ -146,22 +499,60 @@ class Runtime(abc.ABC):
 
         return diagnostics, code_actions
 
+    def _replay_edits(
+        self,
+        command: str,
+        diagnostics: List[DiagnosticWithUri],
+        code_actions: List[CodeAction],
+        since: Optional[int],
+    ) -> Optional[Tuple[List[DiagnosticWithUri], List[CodeAction]]]:
+        """Apply edits made after `since` to new results, or return None to drop them"""
+        # NOTE: Called with `self._lock` held
+        return diagnostics, code_actions
+
     def _update_diagnostics(
         self,
         command: str,
         target_files: Optional[List[pathlib.Path]],
+        cancel: Optional[threading.Event] = None,
+        since: Optional[int] = None,
     ) -> None:
+        if is_cancelled(cancel):
+            return
+
         reporter_factory = self._run_pysen(command, target_files)
         diagnostics, code_actions = self._convert_reports(command, reporter_factory)
         with self._lock:
-            self._diagnostics[command] = diagnostics
-            self._code_actions[command] = code_actions
+            # NOTE: Results of a cancelled run may be older than the current ones
+            if is_cancelled(cancel):
+                return
 
-    def iter_diagnostics(self) -> Iterable[DiagnosticWithUri]:
-        return chain.from_iterable(self._diagnostics.values())
+            results = self._replay_edits(command, diagnostics, code_actions, since)
+            if results is None:
+                _logger.info(f"dropped outdated results of {command}")
+                return
 
-    def iter_code_actions(self) -> Iterable[CodeAction]:
-        return chain.from_iterable(self._code_actions.values())
+            diagnostics, code_actions = results
+            self._diagnostics = {**self._diagnostics, command: diagnostics}
+            self._code_actions = {**self._code_actions, command: code_actions}
+
+    def _update_all_diagnostics(
+        self,
+        commands: Sequence[str],
+        target_files: Optional[List[pathlib.Path]],
+        cancel: Optional[threading.Event] = None,
+        since: Optional[int] = None,
+    ) -> None:
+        # NOTE: Commands run in the given order since they may depend on each other.
+        # e.g. `format` edits files in place, which affects the following `lint`.
+        for command in commands:
+            self._update_diagnostics(command, target_files, cancel, since)
+
+    def iter_diagnostics(self) -> List[DiagnosticWithUri]:
+        return _flatten(self._diagnostics.values())
+
+    def iter_code_actions(self) -> List[CodeAction]:
+        return _flatten(self._code_actions.values())
 
 
 class WorkspaceRuntime(Runtime):
@@ -175,11 +566,25 @@ class WorkspaceRuntime(Runtime):
     def get_version(self, uri: str) -> Optional[DocumentVersionType]:
         return None
 
+    def iter_diagnostics(self) -> List[DiagnosticWithUri]:
+        # NOTE: Sorted by uri so that callers can group them with itertools.groupby
+        diagnostics = super().iter_diagnostics()
+        diagnostics.sort(key=attrgetter("uri"))
+        return diagnostics
+
     def update_diagnostics(
         self,
         command: str,
+        cancel: Optional[threading.Event] = None,
+    ) -> None:
+        self._update_diagnostics(command, None, cancel)
+
+    def update_all_diagnostics(
+        self,
+        commands: Sequence[str],
+        cancel: Optional[threading.Event] = None,
     ) -> None:
-        self._update_diagnostics(command, None)
+        self._update_all_diagnostics(commands, None, cancel)
 
 
 class FileRuntime(Runtime):
@@ -187,13 +592,26 @@ class FileRuntime(Runtime):
         path = target_path.resolve()
         self._version: Optional[DocumentVersionType] = None
         super().__init__(base_uri, path, path.parent)
+        # NOTE: Comparing strings is cheaper than comparing `PurePath` objects
+        self._target_path_str = str(path)
+        # NOTE: Runs lint the file on disk while the document may be edited,
+        # so edits made during a run are replayed onto its results.
+        # `_edit_generation` counts all the edits including discarded ones.
+        self._edits: Deque[Tuple[Range, str]] = collections.deque(
+            maxlen=_MAX_EDIT_HISTORY
+        )
+        self._edit_generation = 0
 
     @property
     def uri(self) -> str:
         return self._base_uri
 
+    @property
+    def edit_generation(self) -> int:
+        return self._edit_generation
+
     def get_uri(self, path: pathlib.Path) -> Optional[str]:
-        if self._target_path != path:
+        if str(path) != self._target_path_str:
             return None
 
         return self._base_uri
@@ -203,67 +621,66 @@ class FileRuntime(Runtime):
 
     def update_diagnostics_range(self, updated_range: Range, update_text: str) -> None:
         """Incremental diagnostic update"""
-        # NOTE: splitlines() ignores the last line if empty while split() doesn't
-        # e.g. '' -> [], 'a\n' -> ['a']
-        # Here we need the split() behavior while splitlines() can split lines with
-        # unversal newlines.
-        # Hence we add character 'a' to the given text, then remove it after we call
-        # splitlines() so that we can get the last empty line
-        to_add = (update_text + "a").splitlines()
-        to_add[-1] = to_add[-1][:-1]
-        num_remove_lines = updated_range.end.line - updated_range.start.line
-        num_add_lines = len(to_add) - 1
-        num_updated_lines = num_add_lines - num_remove_lines
-        num_add_characters_last_line = len(to_add[-1])
-
-        def update_logic(target_range: Range) -> bool:
-            if target_range.end < updated_range.start:
-                return True
-
-            if target_range.start.line >= updated_range.end.line:
-                # update position
-                target_range.start.line += num_updated_lines
-                target_range.end.line += num_updated_lines
-                if target_range.start.line == updated_range.end.line:
-                    if target_range.start.character <= updated_range.end.character:
-                        return False
-
-                    target_range.start.character += num_add_characters_last_line
-                return True
-
-            return False
-
-        for command, code_actions in self._code_actions.items():
-            for code_action in code_actions:
-                if code_action.edit is None:
-                    continue
-
-                keep = True
-                for change in code_action.edit.document_changes:
-                    if not isinstance(change, TextDocumentEdit):
-                        continue
+        self.update_diagnostics_ranges([(updated_range, update_text)])
 
-                    for edit in change.edits:
-                        keep = keep and update_logic(edit.range)
-
-                if code_action.diagnostics is not None:
-                    for diagnostic in code_action.diagnostics:
-                        keep = keep and update_logic(diagnostic.range)
+    def update_diagnostics_ranges(
+        self, text_edits: Sequence[Tuple[Range, str]]
+    ) -> None:
+        """Incremental diagnostic update for text edits applied in order"""
+        # NOTE: Results are shifted (and copied) once for all the edits
+        with self._lock:
+            self._edits.extend(text_edits)
+            self._edit_generation += len(text_edits)
+            self._diagnostics, self._code_actions = _shift_results(
+                self._diagnostics, self._code_actions, text_edits
+            )
 
-                if not keep:
-                    code_action.edit = None
+    def _replay_edits(
+        self,
+        command: str,
+        diagnostics: List[DiagnosticWithUri],
+        code_actions: List[CodeAction],
+        since: Optional[int],
+    ) -> Optional[Tuple[List[DiagnosticWithUri], List[CodeAction]]]:
+        if since is None or since == self._edit_generation:
+            return diagnostics, code_actions
+
+        num_edits = self._edit_generation - since
+        if num_edits > len(self._edits):
+            return None
 
-            self._code_actions[command] = [
-                c for c in code_actions if c.edit is not None
-            ]
+        shifted_diagnostics, shifted_code_actions = _shift_results(
+            {command: diagnostics},
+            {command: code_actions},
+            list(islice(self._edits, len(self._edits) - num_edits, None)),
+        )
+        return shifted_diagnostics[command], shifted_code_actions[command]
 
     def update_diagnostics(
         self,
         command: str,
         document_version: Optional[DocumentVersionType],
+        cancel: Optional[threading.Event] = None,
+        since: Optional[int] = None,
     ) -> None:
+        # NOTE: `since` is the edit generation at which the file on disk matched
+        # the document, which defaults to the current one
+        if since is None:
+            since = self._edit_generation
         self._version = document_version
-        self._update_diagnostics(command, [self._target_path])
+        self._update_diagnostics(command, [self._target_path], cancel, since)
+
+    def update_all_diagnostics(
+        self,
+        commands: Sequence[str],
+        document_version: Optional[DocumentVersionType],
+        cancel: Optional[threading.Event] = None,
+        since: Optional[int] = None,
+    ) -> None:
+        if since is None:
+            since = self._edit_generation
+        self._version = document_version
+        self._update_all_diagnostics(commands, [self._target_path], cancel, since)
 
     def get_diagnostics(self) -> List[Diagnostic]:
         diagnostics = self.iter_diagnostics()
@@ -273,16 +690,15 @@ class FileRuntime(Runtime):
         self,
         target_range: Range,
     ) -> List[CodeAction]:
-        code_actions = self.iter_code_actions()
         if target_range is None:
-            return list(code_actions)
-
-        filtered: List[CodeAction] = []
-        for code_action in code_actions:
-            if code_action.diagnostics is None or len(code_action.diagnostics) == 0:
-                continue
+            return self.iter_code_actions()
 
-            if any(has_overlap(d.range, target_range) for d in code_action.diagnostics):
-                filtered.append(code_action)
+        code_actions = self._code_actions
+        cached = self._code_action_index
+        if cached is not None and cached[0] is code_actions:
+            index = cached[1]
+        else:
+            index = _CodeActionIndex(_flatten(code_actions.values()))
+            self._code_action_index = (code_actions, index)
 
-        return filtered
+        return index.query(target_range)
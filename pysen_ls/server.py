@@ -1,22 +1,78 @@
-import collections
+import asyncio
+import concurrent.futures
+import contextlib
 import enum
+import functools
+import itertools
 import logging
+import os
 import pathlib
-from typing import Any, Callable, DefaultDict, List, Optional, Sequence, Union
+import posixpath
+import threading
+from operator import attrgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from pydantic import ValidationError
 from pygls import lsp
 from pygls.server import LanguageServer
 
-from .config import LanguageServerConfiguration
+from .config import LanguageServerConfiguration, parse_config
 from .diagnostic import Diagnostic
 from .logger import LanguageServerLogHandler
-from .runtime import FileRuntime, WorkspaceRuntime
+from .runtime import (
+    FileRuntime,
+    WorkspaceRuntime,
+    is_cancelled,
+    reset_cache,
+    warmup,
+)
 from .workspace import Workspace
 
 _logger = logging.getLogger(__name__)
 
 CONFIGURATION_SECTION_NAME = "pysen.server"
+PYPROJECT_FILENAME = "pyproject.toml"
+# NOTE: didChange notifications within this interval (sec) are applied at once
+DID_CHANGE_DEBOUNCE_INTERVAL = 0.02
+
+# NOTE: The params are constant and pygls only serializes them
+_CONFIG_PARAMS = lsp.types.ConfigurationParams(
+    items=[
+        lsp.types.ConfigurationItem(scope_uri="", section=CONFIGURATION_SECTION_NAME)
+    ]
+)
+
+_WATCHED_FILES_REGISTRATION = lsp.types.RegistrationParams(
+    registrations=[
+        lsp.types.Registration(
+            id="pysen.watchPyproject",
+            method=lsp.methods.WORKSPACE_DID_CHANGE_WATCHED_FILES,
+            register_options=lsp.types.DidChangeWatchedFilesRegistrationOptions(
+                watchers=[
+                    lsp.types.FileSystemWatcher(glob_pattern=f"**/{PYPROJECT_FILENAME}")
+                ]
+            ),
+        )
+    ]
+)
+
+_WORKSPACE_TASK_KEY = "$workspace"
+# NOTE: (uri or _WORKSPACE_TASK_KEY, targets)
+_TaskKey = Tuple[str, Tuple[str, ...]]
+
+_T = TypeVar("_T")
 
 
 class Commands:
@@ -47,6 +103,82 @@ def _get_request_params(
     return uri
 
 
+def _to_registrable(handler: Callable[..., Any]) -> Callable[..., Any]:
+    # NOTE: pygls calls setattr in `feature` and `command` decorators
+    # to add their own field. Since a method doesn't allow setattr for
+    # undefined fields, we cannot use it for the decorator.
+    # functools.partial allows setattr and adds no Python frame per call.
+    # Coroutine handlers are wrapped by a coroutine function instead since
+    # pygls awaits only coroutine functions, and asyncio.iscoroutinefunction
+    # doesn't see through partial objects before Python 3.8.
+    if asyncio.iscoroutinefunction(handler):
+
+        async def cb(*args: Any, **kwargs: Any) -> Any:
+            return await handler(*args, **kwargs)
+
+        return cb
+
+    return functools.partial(handler)
+
+
+def _hash_diagnostics(diagnostics: Sequence[Diagnostic]) -> int:
+    return hash(
+        tuple(
+            (
+                d.range.start.line,
+                d.range.start.character,
+                d.range.end.line,
+                d.range.end.character,
+                d.message,
+                d.code,
+            )
+            for d in diagnostics
+        )
+    )
+
+
+class _SharedLock:
+    """Lock held by either any number of shared owners or one exclusive owner"""
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._num_shared = 0
+        self._exclusive = False
+        # NOTE: New shared owners wait for exclusive ones so as not to starve them
+        self._num_waiting_exclusive = 0
+
+    @contextlib.contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._condition:
+            while self._exclusive or self._num_waiting_exclusive > 0:
+                self._condition.wait()
+            self._num_shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._num_shared -= 1
+                if self._num_shared == 0:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._condition:
+            self._num_waiting_exclusive += 1
+            try:
+                while self._exclusive or self._num_shared > 0:
+                    self._condition.wait()
+            finally:
+                self._num_waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
 class Server:
     def __init__(
         self,
@@ -67,6 +199,37 @@ class Server:
         self._server = LanguageServer()
         self._config = LanguageServerConfiguration.default()
         self._workspace = Workspace(self._server)
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._can_watch_files = False
+
+        # NOTE: Pending changes are only accessed from the event loop thread,
+        # where the debounce timers run as well.
+        self._pending_changes: Dict[str, List[Tuple[lsp.types.Range, str]]] = {}
+        self._debounce_timers: Dict[str, asyncio.TimerHandle] = {}
+        # NOTE: Number of runtimes being created for each document. Changes to
+        # such a document are kept pending until its runtime is available.
+        self._creating_runtimes: Dict[str, int] = {}
+
+        # NOTE: A new run for the same key cancels the previous run.
+        # Runs for the same document (or the workspace) never overlap
+        # since pysen may rewrite files while formatting.
+        # Workspace runs cover every document, so they hold `_scope_lock`
+        # exclusively while document runs share it.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=os.cpu_count()
+        )
+        self._tasks_lock = threading.Lock()
+        self._tasks: Dict[
+            _TaskKey, Tuple[concurrent.futures.Future[None], threading.Event]
+        ] = {}
+        # NOTE: Lock of each document (or the workspace) with its number of
+        # submitted tasks. The lock is removed when the last of them is done.
+        self._run_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._scope_lock = _SharedLock()
+
+        # NOTE: Hash of the diagnostics last published for each document
+        self._publish_lock = threading.Lock()
+        self._last_published: Dict[str, int] = {}
 
         self._register_command(
             Commands.ReloadServerConfiguration,
@@ -95,11 +258,21 @@ class Server:
             None,
             self._on_initialize,
         )
+        self._register_feature(
+            lsp.methods.INITIALIZED,
+            None,
+            self._on_initialized,
+        )
         self._register_feature(
             lsp.methods.WORKSPACE_DID_CHANGE_CONFIGURATION,
             None,
             self._on_workspace_did_change_configuration,
         )
+        self._register_feature(
+            lsp.methods.WORKSPACE_DID_CHANGE_WATCHED_FILES,
+            None,
+            self._on_workspace_did_change_watched_files,
+        )
         self._register_feature(
             lsp.methods.FORMATTING,
             lsp.types.DocumentFormattingOptions(),
@@ -134,40 +307,23 @@ class Server:
         )
 
     def _register_command(self, command_name: str, handler: Callable[..., Any]) -> None:
-        @self._server.command(command_name)
-        def cb(*args: Any, **kwargs: Any) -> Any:
-            return handler(*args, **kwargs)
+        self._server.command(command_name)(_to_registrable(handler))
 
     def _register_feature(
         self, feature_name: str, option: Any, handler: Callable[..., Any]
     ) -> None:
-        # NOTE: pygls calls setattr in `feature` decorator to add their own field.
-        # Since a method doesn't allow setattr for undefined fields,
-        # we cannot use it for the decorator.
-        # Thus We define temporary function instead.
-        @self._server.feature(feature_name, option)
-        def cb(*args: Any, **kwargs: Any) -> Any:
-            return handler(*args, **kwargs)
+        self._server.feature(feature_name, option)(_to_registrable(handler))
 
     def _on_config_received(self, data: Any) -> None:
         try:
-            self._config = LanguageServerConfiguration.parse_obj(data[0])
+            self._config = parse_config(data[0])
         except ValidationError as e:
             self._server.show_message_log(f"Error occurred: {e}")
         except Exception as e:
             self._server.show_message_log(f"Error occurred: {e}")
 
     def _request_config(self) -> None:
-        self._server.get_configuration(
-            lsp.types.ConfigurationParams(
-                items=[
-                    lsp.types.ConfigurationItem(
-                        scope_uri="", section=CONFIGURATION_SECTION_NAME
-                    )
-                ]
-            ),
-            self._on_config_received,
-        )
+        self._server.get_configuration(_CONFIG_PARAMS, self._on_config_received)
 
     def _on_initialize(self, params: lsp.types.InitializeParams) -> None:
         self._log_handler.server = self._server
@@ -178,12 +334,81 @@ class Server:
         # User defined methods are wrapped by the decorator in pygls,
         # and it doesn't use the return values from the methods.
         # See: https://github.com/openlawlibrary/pygls/blob/b5dcfa36ee3fab2cd0f3bf29248d58f5ad3b6796/pygls/protocol.py#L62-L75  # NOQA
+        workspace = params.capabilities.workspace
+        self._can_watch_files = bool(
+            workspace is not None
+            and workspace.did_change_watched_files is not None
+            and workspace.did_change_watched_files.dynamic_registration
+        )
+
         options = params.initialization_options
         if options is not None:
             config = options.get("config", None)
             if config is not None:
                 self._on_config_received([config])
 
+    def _on_initialized(self, params: lsp.types.InitializedParams) -> None:
+        # NOTE: The client has already received the capabilities at this point.
+        self.warmup()
+        # NOTE: Clients send didChangeWatchedFiles only for registered watchers
+        if self._can_watch_files:
+            self._server.register_capability(_WATCHED_FILES_REGISTRATION, None)
+
+    def warmup(self) -> None:
+        """Load the pysen project of the workspace in the background"""
+        root_path = self._server.workspace.root_path
+        if root_path is None or self._warmup_thread is not None:
+            return
+
+        self._warmup_thread = threading.Thread(
+            target=warmup, args=(pathlib.Path(root_path),), daemon=True
+        )
+        self._warmup_thread.start()
+
+    def _wait_warmup(self) -> None:
+        thread = self._warmup_thread
+        if thread is not None:
+            thread.join()
+
+    async def _run_in_executor(self, func: Callable[..., _T], *args: Any) -> _T:
+        """Run a blocking function without blocking the event loop"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _create_file_runtime(
+        self, uri: str, force: bool = False
+    ) -> Optional[FileRuntime]:
+        self._wait_warmup()
+        return self._workspace.create_file_runtime(uri, force=force)
+
+    async def _prepare_file_runtime(
+        self, uri: str, force: bool = False
+    ) -> Tuple[Optional[FileRuntime], int]:
+        """Create the runtime without dropping the changes received meanwhile"""
+        # NOTE: Also returns the edit generation at which the creation started,
+        # so that the changes received meanwhile are replayed onto the results
+        current = self._workspace.get_file_runtime(uri)
+        since = 0 if current is None else current.edit_generation
+        self._creating_runtimes[uri] = self._creating_runtimes.get(uri, 0) + 1
+        try:
+            runtime = await self._run_in_executor(self._create_file_runtime, uri, force)
+        finally:
+            count = self._creating_runtimes.pop(uri) - 1
+            if count > 0:
+                self._creating_runtimes[uri] = count
+
+        if runtime is not current:
+            # NOTE: No changes have been applied to the new runtime yet
+            since = 0
+        self._flush_changes(uri)
+        return runtime, since
+
+    def _get_workspace_runtime(
+        self, root_uri: str, root_path: pathlib.Path
+    ) -> Optional[WorkspaceRuntime]:
+        self._wait_warmup()
+        return self._workspace.get_workspace_runtime(root_uri, root_path)
+
     def _on_workspace_did_change_configuration(
         self, params: lsp.types.DidChangeConfigurationParams
     ) -> None:
@@ -193,67 +418,215 @@ class Server:
             if config is not None:
                 self._on_config_received([config])
 
+    def _on_workspace_did_change_watched_files(
+        self, params: lsp.types.DidChangeWatchedFilesParams
+    ) -> None:
+        # NOTE: Runtimes keep the project they were created with,
+        # so they are dropped and created again on the next request.
+        if any(
+            posixpath.basename(change.uri) == PYPROJECT_FILENAME
+            for change in params.changes
+        ):
+            _logger.info("pyproject.toml changed, resetting the runtimes")
+            reset_cache()
+            self._workspace.reset()
+
+    def _run_task(
+        self,
+        key: _TaskKey,
+        task: Callable[[threading.Event], None],
+        cancel: threading.Event,
+        lock: threading.Lock,
+    ) -> None:
+        if key[0] == _WORKSPACE_TASK_KEY:
+            scope = self._scope_lock.exclusive()
+        else:
+            scope = self._scope_lock.shared()
+
+        # NOTE: Locks are always taken in this order
+        with lock:
+            if cancel.is_set():
+                return
+            with scope:
+                if cancel.is_set():
+                    return
+                task(cancel)
+
+    def _submit_task(
+        self,
+        key: _TaskKey,
+        task: Callable[[threading.Event], None],
+    ) -> "concurrent.futures.Future[None]":
+        cancel = threading.Event()
+        with self._tasks_lock:
+            lock, num_tasks = self._run_locks.get(key[0], (threading.Lock(), 0))
+            self._run_locks[key[0]] = (lock, num_tasks + 1)
+            previous = self._tasks.get(key)
+            future = self._executor.submit(self._run_task, key, task, cancel, lock)
+            self._tasks[key] = (future, cancel)
+
+        # NOTE: Future.cancel() calls the done callbacks, which take `_tasks_lock`
+        if previous is not None:
+            previous_future, previous_cancel = previous
+            previous_cancel.set()
+            previous_future.cancel()
+
+        future.add_done_callback(functools.partial(self._on_task_done, key))
+        return future
+
+    def _on_task_done(
+        self, key: _TaskKey, future: "concurrent.futures.Future[None]"
+    ) -> None:
+        with self._tasks_lock:
+            current = self._tasks.get(key)
+            if current is not None and current[0] is future:
+                del self._tasks[key]
+
+            lock, num_tasks = self._run_locks[key[0]]
+            if num_tasks == 1:
+                del self._run_locks[key[0]]
+            else:
+                self._run_locks[key[0]] = (lock, num_tasks - 1)
+
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            _logger.error(f"an error occurred while running {key}", exc_info=error)
+
+    def _cancel_tasks(self, scope: str) -> None:
+        with self._tasks_lock:
+            tasks = [task for key, task in self._tasks.items() if key[0] == scope]
+
+        # NOTE: Future.cancel() calls the done callbacks, which take `_tasks_lock`
+        for future, cancel in tasks:
+            cancel.set()
+            future.cancel()
+
+    def _publish_diagnostics(
+        self,
+        items: Iterable[Tuple[str, List[Diagnostic]]],
+        cancel: Optional[threading.Event] = None,
+    ) -> None:
+        """Publish diagnostics unless they are the same as the last published ones"""
+        hashed = [
+            (uri, diagnostics, _hash_diagnostics(diagnostics))
+            for uri, diagnostics in items
+        ]
+        # NOTE: The lock is taken once for all the documents in the batch.
+        # Cancellation is checked under the lock so that no run publishes
+        # after its document is closed.
+        with self._publish_lock:
+            if is_cancelled(cancel):
+                return
+            for uri, diagnostics, key in hashed:
+                if self._last_published.get(uri) == key:
+                    continue
+                self._last_published[uri] = key
+                self._server.publish_diagnostics(uri, diagnostics)
+
     def _publish_file_diagnostics(
         self,
         targets: Sequence[str],
         runtime: FileRuntime,
+        cancel: Optional[threading.Event] = None,
+        since: Optional[int] = None,
     ) -> None:
-        for target in targets:
-            runtime.update_diagnostics(target, None)
+        runtime.update_all_diagnostics(targets, None, cancel, since)
+
+        if is_cancelled(cancel):
+            return
 
         diagnostics = runtime.get_diagnostics()
-        self._server.publish_diagnostics(
-            runtime.uri,
-            diagnostics,
-        )
+        self._publish_diagnostics([(runtime.uri, diagnostics)], cancel)
 
     def _publish_workspace_diagnostics(
         self,
         targets: Sequence[str],
         runtime: WorkspaceRuntime,
+        cancel: Optional[threading.Event] = None,
     ) -> None:
-        for target in targets:
-            runtime.update_diagnostics(target)
+        runtime.update_all_diagnostics(targets, cancel)
 
-        to_publish: DefaultDict[str, List[Diagnostic]] = collections.defaultdict(list)
-        data = list(runtime.iter_diagnostics())
+        if is_cancelled(cancel):
+            return
 
-        for d in data:
-            to_publish[d.uri].append(d.diagnostic)
+        # NOTE: WorkspaceRuntime returns diagnostics sorted by uri
+        grouped = itertools.groupby(runtime.iter_diagnostics(), key=attrgetter("uri"))
+        self._publish_diagnostics(
+            ((uri, [d.diagnostic for d in group]) for uri, group in grouped), cancel
+        )
 
-        for uri, diagnostics in to_publish.items():
-            self._server.publish_diagnostics(
-                uri,
-                diagnostics,
-            )
+    def _submit_file_diagnostics(
+        self,
+        targets: Sequence[str],
+        runtime: FileRuntime,
+        since: Optional[int] = None,
+    ) -> "concurrent.futures.Future[None]":
+        # NOTE: The run lints the file on disk, so the edits received after
+        # `since` (defaults to this point) are replayed onto its results
+        self._flush_changes(runtime.uri)
+        if since is None:
+            since = runtime.edit_generation
+        return self._submit_task(
+            (runtime.uri, tuple(targets)),
+            functools.partial(
+                self._publish_file_diagnostics, targets, runtime, since=since
+            ),
+        )
+
+    def _submit_workspace_diagnostics(
+        self,
+        targets: Sequence[str],
+        runtime: WorkspaceRuntime,
+    ) -> "concurrent.futures.Future[None]":
+        return self._submit_task(
+            (_WORKSPACE_TASK_KEY, tuple(targets)),
+            functools.partial(self._publish_workspace_diagnostics, targets, runtime),
+        )
 
     def _on_reload_server_config(self, *args: Any) -> None:
         self._request_config()
 
-    def _handle_document_command(self, request: Any, targets: Sequence[str]) -> None:
+    async def _handle_document_command(
+        self, request: Any, targets: Sequence[str]
+    ) -> Optional["concurrent.futures.Future[None]"]:
         uri = _get_request_params(request)
         if uri is None:
-            return
+            return None
 
-        runtime = self._workspace.create_file_runtime(uri, force=True)
+        runtime, since = await self._prepare_file_runtime(uri, True)
         if runtime is None:
-            return
+            return None
 
-        self._publish_file_diagnostics(targets, runtime)
+        return self._submit_file_diagnostics(targets, runtime, since)
 
-    def _on_formatting(self, params: lsp.types.DocumentFormattingParams) -> None:
+    async def _on_formatting(self, params: lsp.types.DocumentFormattingParams) -> None:
         # TODO: Consider adding unregistration config of this capability
         # for someone who wants opt-out this feature.
         uri = params.text_document.uri
-        self._handle_document_command([uri], self._config.format_targets)
+        future = await self._handle_document_command([uri], self._config.format_targets)
+        if future is None:
+            return
 
-    def _on_lint_document(self, args: Any) -> None:
-        self._handle_document_command(args, self._config.lint_targets)
+        # NOTE: Clients expect the document to be formatted when we respond
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # NOTE: Superseded by a newer run; otherwise the request itself is cancelled
+            if not future.cancelled():
+                raise
 
-    def _on_format_document(self, args: Any) -> None:
-        self._handle_document_command(args, self._config.format_targets)
+    async def _on_lint_document(self, args: Any) -> None:
+        await self._handle_document_command(args, self._config.lint_targets)
 
-    def _handle_workspace_command(self, request: Any, targets: Sequence[str]) -> None:
+    async def _on_format_document(self, args: Any) -> None:
+        await self._handle_document_command(args, self._config.format_targets)
+
+    async def _handle_workspace_command(
+        self, request: Any, targets: Sequence[str]
+    ) -> None:
         root_uri = self._server.workspace.root_uri
         root_path = self._server.workspace.root_path
         if root_uri is None or root_path is None:
@@ -262,57 +635,69 @@ class Server:
             )
             return
 
-        runtime = self._workspace.get_workspace_runtime(
-            root_uri, pathlib.Path(root_path)
+        runtime = await self._run_in_executor(
+            self._get_workspace_runtime, root_uri, pathlib.Path(root_path)
         )
         if runtime is None:
             return
 
-        self._publish_workspace_diagnostics(targets, runtime)
+        self._submit_workspace_diagnostics(targets, runtime)
 
-    def _on_lint_workspace(self, args: Any) -> None:
-        self._handle_workspace_command(args, self._config.lint_targets)
+    async def _on_lint_workspace(self, args: Any) -> None:
+        await self._handle_workspace_command(args, self._config.lint_targets)
 
-    def _on_format_workspace(self, args: Any) -> None:
-        self._handle_workspace_command(args, self._config.format_targets)
+    async def _on_format_workspace(self, args: Any) -> None:
+        await self._handle_workspace_command(args, self._config.format_targets)
 
-    def _on_text_document_did_open(
+    async def _on_text_document_did_open(
         self, params: lsp.types.DidOpenTextDocumentParams
     ) -> None:
         uri = params.text_document.uri
-        runtime = self._workspace.create_file_runtime(uri)
+        runtime, since = await self._prepare_file_runtime(uri)
         if runtime is None:
             return
 
-        self._publish_file_diagnostics(self._config.lint_targets, runtime)
+        self._submit_file_diagnostics(self._config.lint_targets, runtime, since)
 
     def _on_text_document_did_close(
         self, params: lsp.types.DidCloseTextDocumentParams
     ) -> None:
-        pass
-
-    def _on_text_document_did_save(
+        uri = params.text_document.uri
+        timer = self._debounce_timers.pop(uri, None)
+        if timer is not None:
+            timer.cancel()
+        self._pending_changes.pop(uri, None)
+        self._cancel_tasks(uri)
+        self._workspace.close_document(uri)
+        with self._publish_lock:
+            self._last_published.pop(uri, None)
+
+    async def _on_text_document_did_save(
         self, params: lsp.types.DidSaveTextDocumentParams
     ) -> None:
+        self._flush_changes(params.text_document.uri)
         if not self._config.enable_lint_on_save:
             return None
 
-        runtime = self._workspace.get_file_runtime(params.text_document.uri)
+        # NOTE: The runtime is created again if dropped by a change of pyproject.toml
+        uri = params.text_document.uri
+        runtime, since = await self._prepare_file_runtime(uri)
         if runtime is None:
             return
 
-        self._publish_file_diagnostics(self._config.lint_targets, runtime)
+        self._submit_file_diagnostics(self._config.lint_targets, runtime, since)
 
     def _on_text_document_did_change(
         self,
         params: lsp.types.DidChangeTextDocumentParams,
     ) -> None:
-        runtime = self._workspace.get_file_runtime(params.text_document.uri)
-        if runtime is None:
+        uri = params.text_document.uri
+        runtime = self._workspace.get_file_runtime(uri)
+        if runtime is None and uri not in self._creating_runtimes:
             return
 
-        changes = params.content_changes
-        for change in changes:
+        changes: List[Tuple[lsp.types.Range, str]] = []
+        for change in params.content_changes:
             if not isinstance(change, lsp.types.TextDocumentContentChangeEvent):
                 continue
             change_range = change.range
@@ -320,7 +705,39 @@ class Server:
             if change_range is None:
                 continue
 
-            runtime.update_diagnostics_range(change_range, change.text)
+            changes.append((change_range, change.text))
+
+        if len(changes) == 0:
+            return
+
+        self._pending_changes.setdefault(uri, []).extend(changes)
+        timer = self._debounce_timers.pop(uri, None)
+        if timer is not None:
+            timer.cancel()
+
+        self._debounce_timers[uri] = self._server.loop.call_later(
+            DID_CHANGE_DEBOUNCE_INTERVAL, self._flush_changes, uri
+        )
+
+    def _flush_changes(self, uri: str) -> None:
+        """Apply pending didChange notifications for the document"""
+        timer = self._debounce_timers.pop(uri, None)
+        if timer is not None:
+            timer.cancel()
+
+        runtime = self._workspace.get_file_runtime(uri)
+        if runtime is None:
+            # NOTE: Kept until the runtime being created is available
+            if uri not in self._creating_runtimes:
+                self._pending_changes.pop(uri, None)
+            return
+
+        changes = self._pending_changes.pop(uri, None)
+        if changes is None:
+            return
+
+        # NOTE: The results are shifted once for all the changes
+        runtime.update_diagnostics_ranges(changes)
 
     def _provide_code_action(
         self, params: lsp.types.CodeActionParams
@@ -328,6 +745,8 @@ class Server:
         if not self._config.enable_code_action:
             return None
 
+        # NOTE: Code actions must reflect all the changes received so far
+        self._flush_changes(params.text_document.uri)
         runtime = self._workspace.get_file_runtime(params.text_document.uri)
         if runtime is None:
             return []
@@ -348,3 +767,4 @@ class Server:
                 self._server.start_tcp(self._host, self._port)
         finally:
             self._log_handler.server = None
+            self._executor.shutdown(wait=False)
@@ -5,24 +5,47 @@ from typing import Dict, Optional
 
 from pygls.lsp.types import MessageType
 from pygls.server import LanguageServer
-from pysen.exceptions import PysenError
 
 from .runtime import FileRuntime, WorkspaceRuntime
 
 _logger = logging.getLogger(__name__)
 
+_RUNTIME_SUFFIXES = frozenset({".py", ".pyc"})
+
 
 class Workspace:
     def __init__(self, server: LanguageServer) -> None:
         self._lock = threading.Lock()
         self._server = server
+        # NOTE: `_file_runtimes` is never modified once published.
+        # Writers build a new dict under `self._lock` and swap the reference,
+        # so readers can look up runtimes without the lock.
         self._file_runtimes: Dict[pathlib.Path, FileRuntime] = {}
+        self._uri_to_path: Dict[str, pathlib.Path] = {}
         self._workspace_runtime: Optional[WorkspaceRuntime] = None
 
     def _should_create_runtime(self, path: pathlib.Path) -> bool:
         # NOTE: Files with neither extension .py nor .py will
         # be handled only if the user call trigger commands
-        return path.suffix in [".py", ".pyc"]
+        return path.suffix in _RUNTIME_SUFFIXES
+
+    def _get_path(self, uri: str) -> pathlib.Path:
+        path = self._uri_to_path.get(uri)
+        if path is None:
+            document = self._server.workspace.get_document(uri)
+            path = pathlib.Path(document.path)
+            self._uri_to_path[uri] = path
+        return path
+
+    def close_document(self, uri: str) -> None:
+        """Forget the cached path of the document"""
+        self._uri_to_path.pop(uri, None)
+
+    def reset(self) -> None:
+        """Drop all the runtimes so that they load the project again"""
+        with self._lock:
+            self._file_runtimes = {}
+            self._workspace_runtime = None
 
     def _lookup_file_runtime(self, target_file: pathlib.Path) -> Optional[FileRuntime]:
         return self._file_runtimes.get(target_file, None)
@@ -32,6 +55,13 @@ class Workspace:
         base_uri: str,
         base_path: pathlib.Path,
     ) -> Optional[WorkspaceRuntime]:
+        # NOTE: Check without the lock first since the runtime rarely changes
+        runtime = self._workspace_runtime
+        if runtime is not None and runtime.base_uri == base_uri:
+            return runtime
+
+        from pysen.exceptions import PysenError
+
         with self._lock:
             runtime = self._workspace_runtime
             if runtime is None or runtime.base_uri != base_uri:
@@ -61,15 +91,20 @@ class Workspace:
     def create_file_runtime(
         self, uri: str, force: bool = False
     ) -> Optional[FileRuntime]:
+        path = self._get_path(uri)
+        runtime = self._lookup_file_runtime(path)
+        if runtime is not None:
+            return runtime
+
+        from pysen.exceptions import PysenError
+
         with self._lock:
-            document = self._server.workspace.get_document(uri)
-            path = pathlib.Path(document.path)
             runtime = self._lookup_file_runtime(path)
             if runtime is None and self._should_create_runtime(path):
                 try:
                     _logger.info(f"starting runtime for '{path}'")
                     runtime = FileRuntime(uri, path)
-                    self._file_runtimes[path] = runtime
+                    self._file_runtimes = {**self._file_runtimes, path: runtime}
                     self._server.show_message_log(
                         f"pysen runtime activated: {path}", MessageType.Info
                     )
@@ -91,9 +126,5 @@ class Workspace:
         return runtime
 
     def get_file_runtime(self, uri: str) -> Optional[FileRuntime]:
-        with self._lock:
-            document = self._server.workspace.get_document(uri)
-            path = pathlib.Path(document.path)
-            runtime = self._lookup_file_runtime(path)
-
-            return runtime
+        path = self._get_path(uri)
+        return self._lookup_file_runtime(path)
@@ -26,6 +26,7 @@ setup(
         "dataclasses>=0.6,<1.0;python_version<'3.7'",
         "pygls>=0.10.0,<0.11.0",
         "pysen>=0.9.1,<0.11.0",
+        "tomli>=1.1.0;python_version<'3.11'",
     ],
     package_data={"pysen_ls": ["py.typed"]},
     entry_points={"console_scripts": ["pysen_language_server=pysen_ls.__main__:main"]},
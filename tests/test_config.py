@@ -0,0 +1,32 @@
+import pytest
+from pydantic import ValidationError
+
+from pysen_ls.config import LanguageServerConfiguration, parse_config
+
+
+def test_default() -> None:
+    config = LanguageServerConfiguration.default()
+    assert config == LanguageServerConfiguration(
+        enable_lint_on_save=True,
+        enable_code_action=True,
+        lint_targets=["lint"],
+        format_targets=["format", "lint"],
+    )
+
+    config.lint_targets.append("test")
+    assert LanguageServerConfiguration.default().lint_targets == ["lint"]
+
+
+def test_parse_config() -> None:
+    data = {
+        "enable_lint_on_save": False,
+        "enable_code_action": True,
+        "lint_targets": ["lint"],
+        "format_targets": ["format"],
+    }
+    config = parse_config(data)
+    assert not config.enable_lint_on_save
+    assert parse_config(dict(reversed(list(data.items())))) is config
+
+    with pytest.raises(ValidationError):
+        parse_config({"enable_code_action": True})
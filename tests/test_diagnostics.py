@@ -3,6 +3,7 @@ from typing import List, Optional, Tuple
 
 import pysen.diagnostic
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
 from pygls.lsp.types import (
     CodeActionKind,
     DiagnosticSeverity,
@@ -13,12 +14,15 @@ from pygls.lsp.types import (
     WorkspaceEdit,
 )
 
+import pysen_ls.diagnostic
 from pysen_ls.diagnostic import (
+    _analyze_diff,
     _has_deletion,
     create_code_action,
     create_diagnostic,
     create_text_edit,
     get_diagnostic_range,
+    get_position_key,
     has_overlap,
 )
 
@@ -57,6 +61,15 @@ def test__has_deletion() -> None:
     assert _has_deletion("-hello")
     assert not _has_deletion("+ hello\n+world\n jiro-ls!")
     assert _has_deletion("+ hello\n-world\n jiro-ls!")
+    assert not _has_deletion("+hello-world\n -jiro-ls!\n")
+    assert _has_deletion("+hello\r\n-world")
+
+
+def test__analyze_diff() -> None:
+    assert _analyze_diff("") == (False, "")
+    assert _analyze_diff("+hello\n world\n") == (False, "hello\nworld\n")
+    assert _analyze_diff("-hello\n+world") == (True, "world")
+    assert _analyze_diff(" a\r\n-b\r\n+c") == (True, "a\r\nc")
 
 
 def test_get_diagnostic_range() -> None:
@@ -80,6 +93,16 @@ def test_get_diagnostic_range() -> None:
     assert get_diagnostic_range(diagnostic) == get_range((9, 19), (10, 0))
 
 
+def test_get_position_key() -> None:
+    positions = [
+        Position(line=line, character=character)
+        for line in (0, 1, 100)
+        for character in (0, 1, 2**31)
+    ]
+    keys = [get_position_key(p) for p in positions]
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+
+
 def test_has_overlap() -> None:
     # r1: [0, 0] -> [9, 30]
     # r2: [10, 10] -> [20, 0]
@@ -144,6 +167,10 @@ def test_create_text_edit() -> None:
     assert edit.range == get_range((9, 19), (11, 0))
     assert edit.new_text == ""
 
+    # edits are not shared even though the same diff is given
+    assert create_text_edit(diagnostic) == edit
+    assert create_text_edit(diagnostic).range is not edit.range
+
 
 def test_create_diagnostic() -> None:
     pysen_diagnostic = get_pysen_diagnostic(
@@ -214,3 +241,33 @@ def test_create_code_action() -> None:
     assert change.text_document.uri == "file://source/pysen.py"
     assert change.text_document.version == 1
     assert change.edits == [create_text_edit(pysen_diagnostic)]
+
+
+def test_skip_model_validation(monkeypatch: MonkeyPatch) -> None:
+    pysen_diagnostic = get_pysen_diagnostic(
+        start_line=10,
+        start_column=20,
+        end_line=11,
+        diff="+aaa\n bbb\n-ccc",
+    )
+
+    def create_json() -> Tuple[str, str]:
+        lsp_diagnostic = create_diagnostic(pysen_diagnostic, "error", "E01", "pysen")
+        action = create_code_action(
+            "Format with pysen",
+            "file://source/pysen.py",
+            1,
+            pysen_diagnostic,
+            [lsp_diagnostic],
+        )
+        assert action is not None and action.diagnostics is not None
+        # the runtime relies on the identity of the referenced diagnostics
+        assert action.diagnostics[0] is lsp_diagnostic
+        return (
+            lsp_diagnostic.json(by_alias=True, exclude_unset=True),
+            action.json(by_alias=True, exclude_unset=True),
+        )
+
+    constructed = create_json()
+    monkeypatch.setattr(pysen_ls.diagnostic, "_VALIDATE_MODELS", True)
+    assert create_json() == constructed
@@ -1,10 +1,16 @@
 import logging
+import pathlib
+import time
 from typing import List, cast
 
 from pygls.lsp.types import MessageType
 from pygls.server import LanguageServer
 
-from pysen_ls.logger import LanguageServerLogHandler, _convert_loglevel
+from pysen_ls.logger import (
+    BufferedFileHandler,
+    LanguageServerLogHandler,
+    _convert_loglevel,
+)
 
 
 class FakeServer:
@@ -32,7 +38,8 @@ def test_emit() -> None:
     logger = logging.getLogger("temp")
     logger.setLevel(logging.DEBUG)
 
-    handler = LanguageServerLogHandler()
+    # NOTE: Use a long interval so that only explicit flush() sends messages
+    handler = LanguageServerLogHandler(flush_interval=60.0)
     logger.addHandler(handler)
 
     logger.error("japan")
@@ -45,17 +52,72 @@ def test_emit() -> None:
     logger.warning("osaka")
     logger.error("sendai")
     logger.critical("hokkaido")
+    assert server.received == []
 
+    handler.flush()
     assert server.received == [
         "Log: tokyo",
         "Info: kyoto",
         "Warning: osaka",
-        "Error: sendai",
-        "Error: hokkaido",
+        "Error: sendai\nhokkaido",
     ]
 
     server.received.clear()
+    logger.info("kyoto")
+    logger.info("osaka")
+    logger.error("sendai")
+    # clearing server flushes pending messages
     handler.server = None
+    assert server.received == ["Info: kyoto\nosaka", "Error: sendai"]
 
+    server.received.clear()
     logger.error("nippon")
+    handler.flush()
     assert server.received == []
+    logger.removeHandler(handler)
+
+
+def test_emit_flush_interval() -> None:
+    logger = logging.getLogger("temp_interval")
+    logger.setLevel(logging.DEBUG)
+
+    handler = LanguageServerLogHandler(flush_interval=0.01)
+    logger.addHandler(handler)
+    server = FakeServer()
+    handler.server = cast(LanguageServer, server)
+
+    logger.info("tokyo")
+    for _ in range(100):
+        if server.received:
+            break
+        time.sleep(0.01)
+
+    assert server.received == ["Info: tokyo"]
+    logger.removeHandler(handler)
+
+
+def test_buffered_file_handler(tmp_path: pathlib.Path) -> None:
+    logger = logging.getLogger("temp_file")
+    logger.setLevel(logging.DEBUG)
+
+    log_file = tmp_path / "log.txt"
+    handler = BufferedFileHandler(str(log_file), flush_interval=60.0)
+    logger.addHandler(handler)
+
+    logger.info("tokyo")
+    logger.warning("nagoya")
+    assert log_file.read_text() == ""
+
+    handler.flush()
+    assert log_file.read_text() == "tokyo\nnagoya\n"
+
+    # errors are flushed immediately with the pending records
+    logger.info("kobe")
+    logger.error("kyoto")
+    assert log_file.read_text() == "tokyo\nnagoya\nkobe\nkyoto\n"
+    assert handler._timer is None
+
+    logger.info("osaka")
+    logger.removeHandler(handler)
+    handler.close()
+    assert log_file.read_text() == "tokyo\nnagoya\nkobe\nkyoto\nosaka\n"
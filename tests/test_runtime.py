@@ -0,0 +1,401 @@
+import os
+import pathlib
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+import pysen
+import pysen.diagnostic
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from pygls.lsp.types import CodeAction, Position, Range
+
+from pysen_ls.diagnostic import create_code_action, create_diagnostic, has_overlap
+from pysen_ls.runtime import (
+    DiagnosticWithUri,
+    FileRuntime,
+    WorkspaceRuntime,
+    _find_pyproject,
+    _get_uri,
+    _load_project,
+    reset_cache,
+    warmup,
+)
+
+
+def create_project(base_dir: pathlib.Path) -> pathlib.Path:
+    pyproject = base_dir / "pyproject.toml"
+    pyproject.write_text('[tool.pysen]\nversion = "0.10"\n')
+    return pyproject
+
+
+def get_range(start: Tuple[int, int], end: Tuple[int, int]) -> Range:
+    return Range(
+        start=Position(line=start[0], character=start[1]),
+        end=Position(line=end[0], character=end[1]),
+    )
+
+
+def create_runtime(base_dir: pathlib.Path) -> FileRuntime:
+    create_project(base_dir)
+    path = base_dir / "source.py"
+    path.write_text("")
+    return FileRuntime("file:///source.py", path)
+
+
+def get_code_action(
+    runtime: FileRuntime, start_line: int, start_column: int, end_line: int
+) -> CodeAction:
+    pysen_diagnostic = pysen.diagnostic.Diagnostic(
+        file_path=runtime._target_path,
+        start_line=start_line,
+        end_line=end_line,
+        start_column=start_column,
+        diff="+aaa\n",
+    )
+    lsp_diagnostic = create_diagnostic(pysen_diagnostic, "error", None, "pysen")
+    action = create_code_action(
+        "Format", runtime.uri, None, pysen_diagnostic, [lsp_diagnostic]
+    )
+    assert action is not None
+    return action
+
+
+def get_ranges(code_action: CodeAction) -> List[Range]:
+    assert code_action.edit is not None and code_action.diagnostics is not None
+    ranges = [e.range for c in code_action.edit.document_changes for e in c.edits]
+    return ranges + [d.range for d in code_action.diagnostics]
+
+
+def test__get_uri() -> None:
+    base_uri = "file:///workspace"
+    base_path = pathlib.Path("/workspace")
+    assert (
+        _get_uri(base_uri, base_path, pathlib.Path("/workspace/foo/bar.py"))
+        == "file:///workspace/foo/bar.py"
+    )
+    assert (
+        _get_uri(base_uri, base_path, pathlib.Path("foo/bar.py"))
+        == "file:///workspace/foo/bar.py"
+    )
+    assert (
+        _get_uri(base_uri, base_path, pathlib.Path("/other/bar.py"))
+        == "file:///workspace/../other/bar.py"
+    )
+
+
+def test__find_pyproject(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    sub_dir = tmp_path / "foo" / "bar"
+    sub_dir.mkdir(parents=True)
+    (tmp_path / "foo" / "pyproject.toml").write_text("[tool.black]\nline-length = 88\n")
+
+    with pytest.raises(FileNotFoundError):
+        _find_pyproject(sub_dir)
+
+    # a created pyproject.toml is found without reset_cache()
+    pyproject = create_project(tmp_path)
+    assert _find_pyproject(sub_dir) == pyproject
+    assert _find_pyproject(tmp_path / "foo") == pyproject
+    assert _find_pyproject(tmp_path) == pyproject
+
+    # so is a pysen section added to an existing one
+    sub_pyproject = create_project(tmp_path / "foo")
+    stat = sub_pyproject.stat()
+    os.utime(sub_pyproject, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert _find_pyproject(sub_dir) == sub_pyproject
+
+
+def test_manifest_cache(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    pyproject = create_project(tmp_path)
+    (tmp_path / "a.py").write_text("")
+    (tmp_path / "b.py").write_text("")
+
+    workspace = WorkspaceRuntime("file:///workspace", tmp_path)
+    runtime_a = FileRuntime("file:///workspace/a.py", tmp_path / "a.py")
+    runtime_b = FileRuntime("file:///workspace/b.py", tmp_path / "b.py")
+    assert runtime_a._manifest is workspace._manifest
+    assert runtime_a._runner is runtime_b._runner
+
+    # modifying pyproject.toml invalidates the cache
+    stat = pyproject.stat()
+    os.utime(pyproject, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    runtime_c = FileRuntime("file:///workspace/a.py", tmp_path / "a.py")
+    assert runtime_c._manifest is not runtime_a._manifest
+
+    reset_cache()
+    runtime_d = FileRuntime("file:///workspace/a.py", tmp_path / "a.py")
+    assert runtime_d._manifest is not runtime_c._manifest
+
+
+def test_warmup(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    # NOTE: warmup doesn't raise an error even if the project is not found
+    warmup(tmp_path)
+    assert _load_project.cache_info().currsize == 0
+
+    create_project(tmp_path)
+    reset_cache()
+    warmup(tmp_path)
+    assert _load_project.cache_info().currsize == 1
+
+    WorkspaceRuntime("file:///workspace", tmp_path)
+    assert _load_project.cache_info().hits == 1
+
+
+def test_update_diagnostics_range(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    runtime = create_runtime(tmp_path)
+    before = get_code_action(runtime, 1, 1, 2)
+    after = get_code_action(runtime, 10, 5, 11)
+    same_line = get_code_action(runtime, 4, 10, 4)
+    overlapped = get_code_action(runtime, 3, 1, 6)
+    runtime._code_actions["format"] = [before, after, same_line, overlapped]
+    runtime._diagnostics["format"] = [
+        DiagnosticWithUri(runtime.uri, d)
+        for c in runtime._code_actions["format"]
+        for d in c.diagnostics or []
+    ]
+
+    # insert a new line at (3, 2) (zero-based)
+    runtime.update_diagnostics_range(get_range((3, 2), (3, 2)), "x\nyz")
+    code_actions = runtime._code_actions["format"]
+    assert len(code_actions) == 3
+    assert code_actions[0] is before
+    assert [get_ranges(c) for c in code_actions] == [
+        [get_range((0, 0), (1, 0))] * 2,
+        [get_range((10, 4), (11, 0))] * 2,
+        [get_range((4, 9), (4, 9))] * 2,
+    ]
+    # the published code actions are not modified
+    assert get_ranges(after) == [get_range((9, 4), (10, 0))] * 2
+    assert get_ranges(overlapped) == [get_range((2, 0), (5, 0))] * 2
+    # shared diagnostics are replaced with the shifted ones
+    assert [d.diagnostic for d in runtime._diagnostics["format"]] == [
+        *(d for c in code_actions for d in c.diagnostics or []),
+        overlapped.diagnostics[0],
+    ]
+
+    # remove the line
+    runtime.update_diagnostics_range(get_range((3, 2), (4, 2)), "")
+    code_actions = runtime._code_actions["format"]
+    assert [get_ranges(c) for c in code_actions] == [
+        [get_range((0, 0), (1, 0))] * 2,
+        [get_range((9, 4), (10, 0))] * 2,
+        [get_range((3, 9), (3, 9))] * 2,
+    ]
+
+    # edit in the middle of a code action
+    runtime.update_diagnostics_range(get_range((9, 10), (9, 12)), "abc")
+    assert runtime._code_actions["format"] == [code_actions[0], code_actions[2]]
+
+    # code actions are not copied unless they are shifted
+    code_actions = runtime._code_actions["format"]
+    runtime.update_diagnostics_range(get_range((2, 0), (2, 0)), "abc")
+    assert len(runtime._code_actions["format"]) == 2
+    assert all(a is b for a, b in zip(runtime._code_actions["format"], code_actions))
+
+
+def test_update_diagnostics_ranges(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    runtime = create_runtime(tmp_path)
+    text_edits = [
+        (get_range((3, 2), (3, 2)), "x\nyz"),
+        (get_range((0, 0), (0, 0)), "\n\n"),
+        (get_range((12, 0), (13, 3)), ""),
+        (get_range((7, 1), (7, 4)), "abc"),
+    ]
+
+    def update(one_by_one: bool) -> List[List[Range]]:
+        runtime._code_actions["format"] = [
+            get_code_action(runtime, 1, 1, 2),
+            get_code_action(runtime, 10, 5, 11),
+            get_code_action(runtime, 4, 10, 4),
+            get_code_action(runtime, 3, 1, 6),
+            get_code_action(runtime, 20, 1, 22),
+        ]
+        if one_by_one:
+            for updated_range, text in text_edits:
+                runtime.update_diagnostics_range(updated_range, text)
+        else:
+            runtime.update_diagnostics_ranges(text_edits)
+        return [get_ranges(c) for c in runtime._code_actions["format"]]
+
+    # applying edits at once is the same as applying them one by one
+    expected = update(True)
+    assert len(expected) == 3
+    assert update(False) == expected
+    assert runtime.edit_generation == len(text_edits) * 2
+
+
+def test_query_code_actions(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    runtime = create_runtime(tmp_path)
+    a = get_code_action(runtime, 1, 1, 2)
+    b = get_code_action(runtime, 1, 5, 30)
+    c = get_code_action(runtime, 10, 5, 11)
+    d = get_code_action(runtime, 10, 3, 10)
+    runtime._code_actions["lint"] = [c, a]
+    runtime._code_actions["format"] = [b, d]
+
+    def expected(target: Range) -> List[CodeAction]:
+        return [
+            x
+            for x in runtime.iter_code_actions()
+            if x.diagnostics
+            and any(has_overlap(y.range, target) for y in x.diagnostics)
+        ]
+
+    for start in range(0, 32):
+        for end in range(start, 32):
+            for character in (0, 3, 10):
+                target = get_range((start, character), (end, character))
+                assert runtime.query_code_actions(target) == expected(target)
+
+    assert runtime.query_code_actions(get_range((0, 0), (0, 0))) == [a]
+    assert runtime.query_code_actions(get_range((9, 2), (9, 2))) == [b, d]
+
+    # the index is invalidated by incremental updates
+    runtime.update_diagnostics_range(get_range((0, 0), (0, 0)), "\n")
+    b, d = runtime._code_actions["format"]
+    assert runtime.query_code_actions(get_range((9, 2), (9, 2))) == [b]
+    assert runtime.query_code_actions(get_range((10, 2), (10, 2))) == [b, d]
+
+
+def test_update_all_diagnostics(
+    tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    reset_cache()
+    runtime = create_runtime(tmp_path)
+    called: List[Tuple[str, int]] = []
+
+    def run_pysen(
+        command: str, target_files: Optional[List[pathlib.Path]]
+    ) -> pysen.ReporterFactory:
+        assert target_files == [runtime._target_path]
+        called.append((command, threading.get_ident()))
+        return pysen.ReporterFactory()
+
+    monkeypatch.setattr(runtime, "_run_pysen", run_pysen)
+    # targets run sequentially in the given order
+    runtime.update_all_diagnostics(["format", "lint", "test"], 3)
+    assert called == [(c, threading.get_ident()) for c in ["format", "lint", "test"]]
+    assert sorted(runtime._diagnostics) == ["format", "lint", "test"]
+    assert runtime.get_version(runtime.uri) == 3
+
+
+def test_update_diagnostics_cancel(
+    tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    reset_cache()
+    runtime = create_runtime(tmp_path)
+    cancel = threading.Event()
+
+    def run_pysen(
+        command: str, target_files: Optional[List[pathlib.Path]]
+    ) -> pysen.ReporterFactory:
+        # cancelled while running the command
+        cancel.set()
+        return pysen.ReporterFactory()
+
+    monkeypatch.setattr(runtime, "_run_pysen", run_pysen)
+    runtime.update_diagnostics("lint", None, cancel)
+    assert runtime._diagnostics == {}
+
+    # cancelled before running the command
+    monkeypatch.setattr(runtime, "_run_pysen", None)
+    runtime.update_all_diagnostics(["lint", "test"], None, cancel)
+    assert runtime._diagnostics == {}
+
+
+def test_update_diagnostics_replay_edits(
+    tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    reset_cache()
+    runtime = create_runtime(tmp_path)
+    code_action = get_code_action(runtime, 2, 1, 2)
+    assert code_action.diagnostics is not None
+    diagnostic = DiagnosticWithUri(runtime.uri, code_action.diagnostics[0])
+
+    def run_pysen(
+        command: str, target_files: Optional[List[pathlib.Path]]
+    ) -> pysen.ReporterFactory:
+        # a new line is inserted at the top while running the command
+        runtime.update_diagnostics_range(get_range((0, 0), (0, 0)), "\n")
+        return pysen.ReporterFactory()
+
+    monkeypatch.setattr(runtime, "_run_pysen", run_pysen)
+    monkeypatch.setattr(
+        runtime, "_convert_reports", lambda *args: ([diagnostic], [code_action])
+    )
+    runtime.update_diagnostics("format", None)
+    (shifted,) = runtime._code_actions["format"]
+    assert get_ranges(shifted) == [get_range((2, 0), (2, 0))] * 2
+    assert runtime.get_diagnostics() == shifted.diagnostics
+
+    # edits before `since` are not replayed
+    since = runtime.edit_generation - 1
+    runtime.update_diagnostics("format", None, since=since)
+    (shifted,) = runtime._code_actions["format"]
+    assert get_ranges(shifted) == [get_range((3, 0), (3, 0))] * 2
+
+    # results are dropped if the edits are no longer kept
+    monkeypatch.setattr(runtime, "_run_pysen", lambda *args: pysen.ReporterFactory())
+    before = runtime._code_actions
+    runtime.update_diagnostics("format", None, since=-1024)
+    assert runtime._code_actions is before
+
+
+def test_run_pysen_serialized(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    running: List[int] = []
+    overlapped: List[int] = []
+
+    class Runner:
+        def run(self, *args: Any, **kwargs: Any) -> None:
+            running.append(threading.get_ident())
+            overlapped.append(len(running))
+            time.sleep(0.05)
+            running.pop()
+
+    runtimes: List[FileRuntime] = []
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        runtime = create_runtime(tmp_path / name)
+        runtime._runner = Runner()  # type: ignore
+        runtimes.append(runtime)
+
+    # pysen changes the working directory while running tools
+    threads = [
+        threading.Thread(target=runtime._run_pysen, args=("lint", None))
+        for runtime in runtimes * 2
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlapped == [1, 1, 1, 1]
+
+
+def test_workspace_iter_diagnostics(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    create_project(tmp_path)
+    runtime = WorkspaceRuntime("file:///workspace", tmp_path)
+
+    def get_diagnostic(uri: str, message: str) -> DiagnosticWithUri:
+        pysen_diagnostic = pysen.diagnostic.Diagnostic(
+            file_path=tmp_path, message=message
+        )
+        return DiagnosticWithUri(
+            uri, create_diagnostic(pysen_diagnostic, "error", None, "pysen")
+        )
+
+    a1 = get_diagnostic("file:///workspace/a.py", "1")
+    a2 = get_diagnostic("file:///workspace/a.py", "2")
+    b = get_diagnostic("file:///workspace/b.py", "3")
+    c = get_diagnostic("file:///workspace/c.py", "4")
+    runtime._diagnostics = {"lint": [c, a1], "format": [b, a2]}
+
+    # sorted by uri while keeping the order for each uri
+    assert runtime.iter_diagnostics() == [a1, a2, b, c]
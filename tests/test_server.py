@@ -0,0 +1,330 @@
+import asyncio
+import concurrent.futures
+import pathlib
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from _pytest.monkeypatch import MonkeyPatch
+from pygls.lsp.types import (
+    ClientCapabilities,
+    DidChangeTextDocumentParams,
+    DidChangeWatchedFilesClientCapabilities,
+    DidChangeWatchedFilesParams,
+    DidCloseTextDocumentParams,
+    DidOpenTextDocumentParams,
+    FileChangeType,
+    FileEvent,
+    InitializedParams,
+    InitializeParams,
+    Position,
+    Range,
+    RegistrationParams,
+    TextDocumentContentChangeEvent,
+    TextDocumentIdentifier,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+    WorkspaceClientCapabilities,
+)
+from pygls.workspace import Workspace as LSWorkspace
+
+import pysen_ls.server
+from pysen_ls.diagnostic import Diagnostic
+from pysen_ls.logger import LanguageServerLogHandler
+from pysen_ls.runtime import FileRuntime, reset_cache
+from pysen_ls.server import DID_CHANGE_DEBOUNCE_INTERVAL, ConnectionMethod, Server
+
+
+def create_server() -> Server:
+    return Server(ConnectionMethod.IO, None, None, LanguageServerLogHandler())
+
+
+def create_file_runtime(server: Server, base_dir: pathlib.Path) -> FileRuntime:
+    reset_cache()
+    (base_dir / "pyproject.toml").write_text('[tool.pysen]\nversion = "0.10"\n')
+    (base_dir / "a.py").write_text("")
+    server._server.lsp.workspace = LSWorkspace(base_dir.as_uri())
+    runtime = server._workspace.create_file_runtime((base_dir / "a.py").as_uri())
+    assert runtime is not None
+    return runtime
+
+
+def did_change(server: Server, uri: str, line: int, text: str) -> None:
+    position = Position(line=line, character=0)
+    server._on_text_document_did_change(
+        DidChangeTextDocumentParams(
+            text_document=VersionedTextDocumentIdentifier(uri=uri, version=1),
+            content_changes=[
+                TextDocumentContentChangeEvent(
+                    range=Range(start=position, end=position), text=text
+                )
+            ],
+        )
+    )
+
+
+def create_diagnostic(line: int, message: str) -> Diagnostic:
+    position = Position(line=line, character=0)
+    return Diagnostic(range=Range(start=position, end=position), message=message)
+
+
+def test_publish_diagnostics(monkeypatch: MonkeyPatch) -> None:
+    server = create_server()
+    published: List[Tuple[str, List[Diagnostic]]] = []
+    monkeypatch.setattr(
+        server._server,
+        "publish_diagnostics",
+        lambda uri, diagnostics: published.append((uri, diagnostics)),
+    )
+
+    server._publish_diagnostics(
+        [
+            ("file:///a.py", [create_diagnostic(1, "a")]),
+            ("file:///b.py", [create_diagnostic(1, "a")]),
+        ]
+    )
+    assert [uri for uri, _ in published] == ["file:///a.py", "file:///b.py"]
+
+    # the same diagnostics are not published again
+    server._publish_diagnostics(
+        [
+            ("file:///a.py", [create_diagnostic(1, "a")]),
+            ("file:///b.py", [create_diagnostic(2, "b")]),
+        ]
+    )
+    assert published[2][0] == "file:///b.py"
+    assert len(published) == 3
+
+    server._publish_diagnostics([("file:///a.py", [create_diagnostic(2, "a")])])
+    server._publish_diagnostics([("file:///a.py", [])])
+    assert len(published) == 5
+
+    # closing the document resets the state
+    server._on_text_document_did_close(
+        DidCloseTextDocumentParams(
+            text_document=TextDocumentIdentifier(uri="file:///a.py")
+        )
+    )
+    server._publish_diagnostics([("file:///a.py", [])])
+    assert len(published) == 6
+
+
+def test_did_change_watched_files(monkeypatch: MonkeyPatch) -> None:
+    server = create_server()
+    called: List[None] = []
+    monkeypatch.setattr(pysen_ls.server, "reset_cache", lambda: called.append(None))
+
+    def notify(*uris: str) -> None:
+        server._on_workspace_did_change_watched_files(
+            DidChangeWatchedFilesParams(
+                changes=[
+                    FileEvent(uri=uri, type=FileChangeType.Changed) for uri in uris
+                ]
+            )
+        )
+
+    notify("file:///workspace/foo.py", "file:///workspace/pyproject.toml.bak")
+    assert len(called) == 0
+    notify("file:///workspace/foo.py", "file:///workspace/sub/pyproject.toml")
+    assert len(called) == 1
+    assert server._workspace._file_runtimes == {}
+
+
+def test_register_watched_files(monkeypatch: MonkeyPatch) -> None:
+    registered: List[RegistrationParams] = []
+
+    def initialize(dynamic_registration: bool) -> Server:
+        server = create_server()
+        monkeypatch.setattr(
+            server._server,
+            "register_capability",
+            lambda params, callback: registered.append(params),
+        )
+        monkeypatch.setattr(server, "warmup", lambda: None)
+        capabilities = ClientCapabilities(
+            workspace=WorkspaceClientCapabilities(
+                did_change_watched_files=DidChangeWatchedFilesClientCapabilities(
+                    dynamic_registration=dynamic_registration
+                )
+            )
+        )
+        server._on_initialize(
+            InitializeParams(process_id=None, root_uri=None, capabilities=capabilities)
+        )
+        server._on_initialized(InitializedParams())
+        return server
+
+    initialize(False)
+    assert registered == []
+
+    initialize(True)
+    (registration,) = registered[0].registrations
+    assert registration.method == "workspace/didChangeWatchedFiles"
+    (watcher,) = registration.register_options.watchers
+    assert watcher.glob_pattern == "**/pyproject.toml"
+
+
+def test_workspace_task_excludes_document_tasks() -> None:
+    server = create_server()
+    server._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    started: List[str] = []
+    release = threading.Event()
+
+    def task(name: str) -> None:
+        started.append(name)
+        assert release.wait(5)
+
+    def submit(uri: str, name: str) -> None:
+        server._submit_task((uri, ("lint",)), lambda cancel: task(name))
+
+    def wait_until(condition: Callable[[], bool]) -> None:
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        assert False
+
+    submit("file:///a.py", "a")
+    submit("file:///b.py", "b")
+    wait_until(lambda: len(started) == 2)
+    submit(pysen_ls.server._WORKSPACE_TASK_KEY, "workspace")
+    wait_until(lambda: server._scope_lock._num_waiting_exclusive == 1)
+    # a document run submitted after the workspace run waits for it
+    submit("file:///c.py", "c")
+    time.sleep(0.2)
+    assert sorted(started) == ["a", "b"]
+
+    release.set()
+    server._executor.shutdown(wait=True)
+    assert started[2:] == ["workspace", "c"]
+    # locks are removed with the last task of each document
+    assert server._run_locks == {}
+
+
+def test_did_close_cancels_tasks(monkeypatch: MonkeyPatch) -> None:
+    server = create_server()
+    server._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    uri = "file:///a.py"
+    published: List[str] = []
+    monkeypatch.setattr(
+        server._server,
+        "publish_diagnostics",
+        lambda uri, diagnostics: published.append(uri),
+    )
+    started = threading.Event()
+    release = threading.Event()
+
+    def format_task(cancel: threading.Event) -> None:
+        started.set()
+        assert release.wait(5)
+        server._publish_diagnostics([(uri, [])], cancel)
+
+    server._submit_task((uri, ("format",)), format_task)
+    assert started.wait(5)
+    # queued behind the running task of the same document
+    lint = server._submit_task(
+        (uri, ("lint",)),
+        lambda cancel: server._publish_diagnostics([(uri, [])], cancel),
+    )
+    server._on_text_document_did_close(
+        DidCloseTextDocumentParams(text_document=TextDocumentIdentifier(uri=uri))
+    )
+    release.set()
+    server._executor.shutdown(wait=True)
+    assert lint.done()
+    assert published == []
+    assert server._last_published == {}
+    assert server._tasks == {} and server._run_locks == {}
+
+
+def test_did_change(tmp_path: pathlib.Path, monkeypatch: MonkeyPatch) -> None:
+    server = create_server()
+    runtime = create_file_runtime(server, tmp_path)
+    applied: List[List[Tuple[Range, str]]] = []
+    monkeypatch.setattr(runtime, "update_diagnostics_ranges", applied.append)
+
+    def wait_debounce() -> None:
+        server._server.loop.run_until_complete(
+            asyncio.sleep(DID_CHANGE_DEBOUNCE_INTERVAL * 5)
+        )
+
+    # a burst of changes is applied at once
+    did_change(server, runtime.uri, 1, "a")
+    did_change(server, runtime.uri, 2, "b")
+    assert applied == []
+    wait_debounce()
+    assert [[text for _, text in changes] for changes in applied] == [["a", "b"]]
+
+    # pending changes are applied before they are needed
+    did_change(server, runtime.uri, 3, "c")
+    server._flush_changes(runtime.uri)
+    assert len(applied) == 2
+    wait_debounce()
+    assert len(applied) == 2
+
+    # closing the document discards pending changes
+    did_change(server, runtime.uri, 4, "d")
+    server._on_text_document_did_close(
+        DidCloseTextDocumentParams(
+            text_document=TextDocumentIdentifier(uri=runtime.uri)
+        )
+    )
+    wait_debounce()
+    assert len(applied) == 2
+    assert server._pending_changes == {} and server._debounce_timers == {}
+
+
+def test_did_open_keeps_changes(
+    tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    server = create_server()
+    runtime = create_file_runtime(server, tmp_path)
+    uri = runtime.uri
+    # the document is opened before its runtime is created
+    server._workspace.reset()
+    submitted: List[Tuple[FileRuntime, Optional[int]]] = []
+    monkeypatch.setattr(
+        server,
+        "_submit_file_diagnostics",
+        lambda targets, runtime, since=None: submitted.append((runtime, since)),
+    )
+
+    created = threading.Event()
+    create_file_runtime_ = server._create_file_runtime
+
+    def create(uri: str, force: bool = False) -> Optional[FileRuntime]:
+        assert created.wait(5)
+        return create_file_runtime_(uri, force)
+
+    monkeypatch.setattr(server, "_create_file_runtime", create)
+
+    async def open_and_edit() -> None:
+        opened = asyncio.ensure_future(
+            server._on_text_document_did_open(
+                DidOpenTextDocumentParams(
+                    text_document=TextDocumentItem(
+                        uri=uri, language_id="python", version=1, text=""
+                    )
+                )
+            )
+        )
+        await asyncio.sleep(DID_CHANGE_DEBOUNCE_INTERVAL * 2)
+        # changes received while the runtime is created are not dropped
+        did_change(server, uri, 0, "\n")
+        await asyncio.sleep(DID_CHANGE_DEBOUNCE_INTERVAL * 2)
+        assert server._pending_changes[uri] != []
+        created.set()
+        await opened
+
+    server._server.loop.run_until_complete(open_and_edit())
+    ((opened_runtime, since),) = submitted
+    assert opened_runtime is server._workspace.get_file_runtime(uri)
+    # the changes are replayed onto the results of the run
+    assert since == 0
+    assert opened_runtime.edit_generation == 1
+    assert server._pending_changes == {} and server._creating_runtimes == {}
+
+    # changes are dropped if no runtime is being created
+    server._workspace.reset()
+    did_change(server, uri, 0, "\n")
+    assert server._pending_changes == {}
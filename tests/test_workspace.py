@@ -0,0 +1,42 @@
+import pathlib
+
+from pygls.server import LanguageServer
+from pygls.workspace import Workspace as LSWorkspace
+
+from pysen_ls.runtime import reset_cache
+from pysen_ls.workspace import Workspace
+
+
+def create_workspace(base_dir: pathlib.Path) -> Workspace:
+    server = LanguageServer()
+    server.lsp.workspace = LSWorkspace(base_dir.as_uri())
+    return Workspace(server)
+
+
+def test_file_runtime(tmp_path: pathlib.Path) -> None:
+    reset_cache()
+    (tmp_path / "pyproject.toml").write_text('[tool.pysen]\nversion = "0.10"\n')
+    (tmp_path / "a.py").write_text("")
+    (tmp_path / "a.txt").write_text("")
+    workspace = create_workspace(tmp_path)
+
+    uri = (tmp_path / "a.py").as_uri()
+    assert workspace.get_file_runtime(uri) is None
+    assert workspace._uri_to_path[uri] == tmp_path / "a.py"
+
+    runtime = workspace.create_file_runtime(uri)
+    assert runtime is not None
+    assert workspace.create_file_runtime(uri) is runtime
+    assert workspace.get_file_runtime(uri) is runtime
+
+    # the runtime is kept while the cached path is dropped
+    workspace.close_document(uri)
+    assert uri not in workspace._uri_to_path
+    assert workspace.get_file_runtime(uri) is runtime
+
+    assert workspace.create_file_runtime((tmp_path / "a.txt").as_uri()) is None
+
+    # runtimes are created again after reset
+    workspace.reset()
+    assert workspace.get_file_runtime(uri) is None
+    assert workspace.create_file_runtime(uri) is not runtime